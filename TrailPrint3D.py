@@ -102,6 +102,7 @@ import requests # type: ignore
 import time
 from datetime import date
 from datetime import datetime
+from datetime import timezone
 import bmesh # type: ignore
 from mathutils import Vector, bvhtree, Euler
 import os
@@ -110,6 +111,12 @@ import json
 import platform
 import zlib
 import struct
+import numpy as np
+import threading
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
 
 
 gpx_file_path = ""
@@ -118,8 +125,15 @@ shape = ""
 name = ""
 size =  48
 num_subdivisions = 8
+simplifyTerrain = False
+terrainMaxError = 0.1
+terrainLattice = None #(vertex index grid, RTIN root triangles) of the last created map shape
 scaleElevation = 5
 pathThickness = 1.2
+simplifyMethod = "DOUGLAS_PEUCKER"
+nozzleWidth = 0.4
+elevationThreshold = 0.0
+movingSpeed = 1.0
 pathScale = 0.8
 shapeRotation = 0
 overwritePathElevation = False
@@ -161,6 +175,7 @@ minThickness = 7
 selfHosted = ""
 opentopoAdress = ""
 GPXsections = 0
+chainFiles = [] #(file name, index of its first segment) for every file read by read_gpx_directory
 
 scaleHor = 0
 
@@ -170,16 +185,51 @@ textobj = None
 
 # Define a path to store the counter data
 counter_file = os.path.join(bpy.utils.user_resource('CONFIG'), "api_request_counter.json")
-elevation_cache_file = os.path.join(bpy.utils.user_resource('CONFIG'), "elevation_cache.json")
+elevation_cache_file = os.path.join(bpy.utils.user_resource('CONFIG'), "elevation_cache.json") #legacy JSON cache, migrated once
+elevation_cache_db = os.path.join(bpy.utils.user_resource('CONFIG'), "elevation_cache.sqlite")
 # Set up a cache directory for Terrarium tiles
+# Tiles are stored as {zoom}/{x}/{y}.png (and decoded .npy); folders are created when a tile is written
 terrarium_cache_dir = os.path.join(bpy.utils.user_resource('CONFIG'), "terrarium_cache")
-if not os.path.exists(terrarium_cache_dir):
-    os.makedirs(terrarium_cache_dir)
-
-# In-memory elevation cache
-_elevation_cache = {}
+TERRARIUM_MAX_ZOOM = 15 #deepest zoom level of the Terrarium tile set
+TERRARIUM_DERIVE_DEPTH = 3 #how many finer zoom levels may be combined into a missing tile
+
+# In-memory index of the tile cache {path: [size, last access]}, built on first use
+_tile_index = None
+_tile_index_bytes = 0
+_tile_index_lock = threading.Lock()
+
+# Parsed tracks as .npz files, one per source file (created on first write)
+track_cache_dir = os.path.join(bpy.utils.user_resource('CONFIG'), "track_cache")
+TRACK_CACHE_VERSION = 2 #bump when the Track layout or the parser output changes
+_track_cache_lock = threading.Lock()
+
+# Disk-backed elevation cache (opened on first use)
+_elevation_db = None
+_elevation_db_lock = threading.RLock()
+ELEVATION_CACHE_SCALE = 100000 #lat/lon are stored as integers in 1e-5 degrees
 cacheSize = 100000
 
+# Shared HTTP session for tile downloads (created on first use)
+_http_session = None
+_http_pool_size = 0
+_http_session_lock = threading.Lock()
+
+# Open local Terrarium tile set (MBTiles connection or z/x/y folder), reused between generations
+_terrarium_source = None
+
+# Terrarium tiles of the last map stitched into one raster (TerrariumMosaic), reused by the next generation
+# over the same tiles. Counted against tileMemoryBudget together with the tile LRU
+_terrarium_mosaic = None
+
+# Decoded tiles kept in memory for the whole session (TileLRU, created on first use)
+_tile_lru = None
+
+# Index of the local DEM folder: (folder, folder mtime, hgt tiles, GeoTIFF rasters)
+_local_dem_index = None
+
+# Token buckets per elevation API (created on first use)
+_rate_limiters = {}
+
 #PANEL----------------------------------------------------------------------------------------------------------
 
 def shape_callback(self,context):
@@ -238,6 +288,36 @@ class MyProperties(bpy.types.PropertyGroup):
         maxlen=1024,
         subtype='DIR_PATH'  # Enables folder selection
     )# type: ignore
+    terrariumSource: bpy.props.EnumProperty(
+        name = "瓦片来源",
+        items=[
+            ("ONLINE", "在线 (AWS)", "从 elevation-tiles-prod.s3.amazonaws.com 下载并缓存瓦片"),
+            ("MBTILES", "MBTiles 文件", "从本地 MBTiles (SQLite) 文件读取 Terrarium 瓦片"),
+            ("DIRECTORY", "z/x/y 文件夹", "从本地 z/x/y.png 文件夹读取 Terrarium 瓦片")
+        ],
+        default = "ONLINE"
+    )# type: ignore
+    terrariumMbtiles: bpy.props.StringProperty(
+        name="MBTiles 文件",
+        description="包含 Terrarium 瓦片的 MBTiles 文件",
+        default="",
+        maxlen=1024,
+        subtype='FILE_PATH'  # Enables file selection
+    )# type: ignore
+    terrariumTileDir: bpy.props.StringProperty(
+        name="瓦片文件夹",
+        description="按 z/x/y.png 结构存放 Terrarium 瓦片的文件夹",
+        default="",
+        maxlen=1024,
+        subtype='DIR_PATH'  # Enables folder selection
+    )# type: ignore
+    localDemPath: bpy.props.StringProperty(
+        name="DEM文件夹",
+        description="包含SRTM .hgt 文件或未压缩GeoTIFF (WGS84) 文件的文件夹",
+        default="",
+        maxlen=1024,
+        subtype='DIR_PATH'  # Enables folder selection
+    )# type: ignore
     trailName: bpy.props.StringProperty(name="名称", default="", description="留空则使用文件名") # type: ignore
     
     shape: bpy.props.EnumProperty(
@@ -259,7 +339,8 @@ class MyProperties(bpy.types.PropertyGroup):
         items=[
             ("OPENTOPODATA", "Opentopodata", "Slower but more accurate elevation"),
             ("OPEN-ELEVATION","Open-Elevation","Faster but some regions are low quali"),
-            ("TERRAIN-TILES", "Terrain-Tiles", "Currently Fastest available set")
+            ("TERRAIN-TILES", "Terrain-Tiles", "Currently Fastest available set"),
+            ("LOCAL-DEM", "Local DEM", "SRTM .hgt or GeoTIFF tiles from a local folder, no internet needed")
         ],
         default = "TERRAIN-TILES"
     )# type: ignore
@@ -296,11 +377,27 @@ class MyProperties(bpy.types.PropertyGroup):
 
     objSize: bpy.props.IntProperty(name="地图大小", default = 100, min = 5, max = 10000,description = "地图的尺寸，单位为毫米")
     num_subdivisions: bpy.props.IntProperty(name = "分辨率", default = 8, min = 1, max = 10, description = "(最大推荐值为8) 数值越高地形越详细，但生成速度越慢")
+    simplifyTerrain: bpy.props.BoolProperty(name = "简化地形", default = False, description = "平坦区域使用更少的三角形 (RTIN)。可以显著减小导出文件大小并加快后续处理")
+    terrainMaxError: bpy.props.FloatProperty(name = "最大高度误差", default = 0.1, min = 0.0, max = 10, description = "简化地形时允许的最大垂直误差，单位为毫米")
     scaleElevation: bpy.props.FloatProperty(name = "海拔缩放", default = 2, min = 0, max = 10000, description = "海拔的乘数")
     pathThickness: bpy.props.FloatProperty(name = "路径粗细", default = 1.2, min = 0.1, max = 5, description = "路径的粗细，单位为毫米")
+    simplifyMethod: bpy.props.EnumProperty(
+        name = "路径简化",
+        items=[
+            ("DOUGLAS_PEUCKER", "Douglas-Peucker", "保留偏离直线超过容差的点，直线段只保留端点"),
+            ("VISVALINGAM", "Visvalingam", "逐步移除面积最小的三角形对应的点，曲线更平滑"),
+            ("DISTANCE", "最小距离", "只移除与上一个保留点距离小于容差的点（旧方法）")
+        ],
+        default = "DOUGLAS_PEUCKER",
+        description = "路径顶点的简化方法。容差为 min(喷嘴直径/2, 路径粗细/4) 毫米"
+    )# type: ignore
+    nozzleWidth: bpy.props.FloatProperty(name = "喷嘴直径", default = 0.4, min = 0.1, max = 2, description = "打印机喷嘴直径，单位为毫米。用于计算路径简化的容差")
     shapeRotation: bpy.props.IntProperty(name = "形状旋转", default = 0, min = -360, max = 360, description = "形状的旋转角度") 
     overwritePathElevation: bpy.props.BoolProperty(name="覆盖路径海拔", default=True, description = "将路径的每个点投射到地形网格上")
     o_verticesPath: bpy.props.StringProperty(name="路径顶点数", default="")
+    o_trackStats: bpy.props.StringProperty(name="路径统计", default="")
+    elevationThreshold: bpy.props.FloatProperty(name = "爬升阈值", default = 0, min = 0, max = 50, description = "统计爬升/下降时忽略小于此值的高度变化，单位为米。用于过滤GPS高度噪声")
+    movingSpeed: bpy.props.FloatProperty(name = "移动速度阈值", default = 1.0, min = 0, max = 20, description = "速度低于此值（公里/小时）的时间不计入运动时间")
     o_verticesMap: bpy.props.StringProperty(name="地图顶点数", default="")
     o_mapScale: bpy.props.StringProperty(name="地图比例", default = "")
     o_time: bpy.props.StringProperty(name="生成时间",default="")
@@ -344,6 +441,15 @@ class MyProperties(bpy.types.PropertyGroup):
     tolerance: bpy.props.FloatProperty(name="路径容差", default = 0.2, description="单色模式下路径与地形的融合容差值")
     disableCache: bpy.props.BoolProperty(name="禁用缓存", default = False, description = "如果网格出现孔洞或异常，禁用缓存可能有帮助")
     ccacheSize: bpy.props.IntProperty(name = "缓存大小", default = 50000, min = 0, description="海拔数据缓存的最大条目数")
+    tileWorkers: bpy.props.IntProperty(name = "下载线程数", default = 8, min = 1, max = 32, description="Terrain-Tiles 瓦片并发下载的线程数")
+    tileMemoryBudget: bpy.props.IntProperty(name = "瓦片内存上限 (MB)", default = 256, min = 0, max = 65536, description = "在内存中保留已解码瓦片和拼接后的地形栅格的最大容量，同一会话中的后续生成可直接复用。0 表示不保留")
+    tileCacheQuota: bpy.props.IntProperty(name = "瓦片缓存上限 (MB)", default = 2048, min = 50, max = 1000000, description = "Terrain-Tiles 磁盘缓存的最大容量。超过后删除最久未使用的瓦片")
+    trackCacheQuota: bpy.props.IntProperty(name = "路径缓存上限 (MB)", default = 256, min = 1, max = 100000, description = "已解析GPX路径的磁盘缓存最大容量。超过后删除最久未使用的缓存文件")
+    tileBilinear: bpy.props.BoolProperty(name = "双线性插值", default = False, description = "在相邻像素之间插值海拔（包括跨瓦片边界），避免高分辨率下的阶梯状地形。默认关闭，使用最近像素（与旧版本结果相同）")
+    rateOpenTopoData: bpy.props.FloatProperty(name = "请求频率 (次/秒)", default = 1.0, min = 0.05, max = 100, description="OpenTopoData 每秒允许的平均请求数 (公共API限制为1次/秒)")
+    burstOpenTopoData: bpy.props.IntProperty(name = "突发请求数", default = 1, min = 1, max = 100, description="OpenTopoData 可以连续发送而无需等待的请求数")
+    rateOpenElevation: bpy.props.FloatProperty(name = "请求频率 (次/秒)", default = 0.5, min = 0.05, max = 100, description="Open-Elevation 每秒允许的平均请求数")
+    burstOpenElevation: bpy.props.IntProperty(name = "突发请求数", default = 1, min = 1, max = 100, description="Open-Elevation 可以连续发送而无需等待的请求数")
     
     # 旗帜标记选项
     addFlags: bpy.props.BoolProperty(name="添加旗帜标记", default = False, description="在最低点和最高点添加起点/终点旗帜，用于标记地形极值点")
@@ -482,6 +588,30 @@ class MY_OT_OpenWebsite(bpy.types.Operator):
         open_website(self, context)
         return {'FINISHED'}
 
+class MY_OT_TileCacheInfo(bpy.types.Operator):
+    bl_idname = "wm.tile_cache_info"
+    bl_label = "缓存信息"
+    bl_description = "显示 Terrain-Tiles 磁盘缓存的文件数量和占用空间"
+
+    def execute(self, context):
+        count, size, oldest = tile_cache_info()
+        quota = tile_cache_quota()
+        since = datetime.fromtimestamp(oldest).strftime('%Y-%m-%d') if oldest else "-"
+        message = f"瓦片缓存: {count} 个文件, {size / 2**20:.1f} / {quota / 2**20:.0f} MB, 最早使用: {since}"
+        print(message)
+        show_message_box(message, "INFO", "信息")
+        return {'FINISHED'}
+
+class MY_OT_TileCacheTrim(bpy.types.Operator):
+    bl_idname = "wm.tile_cache_trim"
+    bl_label = "清理缓存"
+    bl_description = "删除最久未使用的瓦片，直到缓存低于设定上限的90%"
+
+    def execute(self, context):
+        removed, freed = trim_tile_cache(tile_cache_quota() * 0.9, target=1.0)
+        show_message_box(f"已删除 {removed} 个瓦片文件 ({freed / 2**20:.1f} MB)", "INFO", "信息")
+        return {'FINISHED'}
+
 def open_discord(self, context):
     webbrowser.open("https://discord.gg/C67H9EJFbz") 
 
@@ -1177,8 +1307,13 @@ class MY_PT_Generate(bpy.types.Panel):
         box.separator()  # Adds a horizontal line
         box.prop(props, "objSize")
         box.prop(props, "num_subdivisions")
+        box.prop(props, "simplifyTerrain")
+        if props.simplifyTerrain:
+            box.prop(props, "terrainMaxError")
         box.prop(props, "scaleElevation")
         box.prop(props, "pathThickness")
+        box.prop(props, "simplifyMethod")
+        box.prop(props, "nozzleWidth")
         box.prop(props, "scalemode")
         if props.scalemode == "FACTOR":
             box.prop(props, "pathScale")
@@ -1231,6 +1366,7 @@ class MY_PT_Advanced(bpy.types.Panel):
             box.prop(props, "tolerance")
             box.prop(props, "disableCache")
             box.prop(props, "ccacheSize")
+            box.prop(props, "trackCacheQuota")
             box.separator()  # Adds a horizontal line
             
             # 旗帜标记选项
@@ -1388,10 +1524,31 @@ class MY_PT_Advanced(bpy.types.Panel):
             box.prop(props,"api")
             if props.api == "OPENTOPODATA":
                 box.prop(props, "dataset")
+                box.prop(props, "rateOpenTopoData")
+                box.prop(props, "burstOpenTopoData")
                 box.separator()  # Adds a horizontal line
                 box.label(text="如果您自托管了Opentopodata服务器:")
                 box.prop(props, "selfHosted")
                 layout.separator()  # Adds a horizontal line
+            if props.api == "OPEN-ELEVATION":
+                box.prop(props, "rateOpenElevation")
+                box.prop(props, "burstOpenElevation")
+            if props.api == "TERRAIN-TILES":
+                box.prop(props, "terrariumSource")
+                box.prop(props, "tileBilinear")
+                box.prop(props, "tileMemoryBudget")
+                if props.terrariumSource == "ONLINE":
+                    box.prop(props, "tileWorkers")
+                    box.prop(props, "tileCacheQuota")
+                    row = box.row()
+                    row.operator("wm.tile_cache_info")
+                    row.operator("wm.tile_cache_trim")
+                elif props.terrariumSource == "MBTILES":
+                    box.prop(props, "terrariumMbtiles")
+                elif props.terrariumSource == "DIRECTORY":
+                    box.prop(props, "terrariumTileDir")
+            if props.api == "LOCAL-DEM":
+                box.prop(props, "localDemPath")
 
         #STATS
         layout.prop(props,"show_stats", icon="TRIA_DOWN" if props.show_stats else "TRIA_RIGHT", emboss=True, text="统计信息")
@@ -1401,6 +1558,9 @@ class MY_PT_Advanced(bpy.types.Panel):
             box.operator("object.show_custom_props_popup")
             box = layout.box()
             box.label(text = props.o_verticesPath)
+            box.label(text = props.o_trackStats)
+            box.prop(props, "elevationThreshold")
+            box.prop(props, "movingSpeed")
             box.label(text = props.o_verticesMap)
             box.label(text = props.o_mapScale)
             box.label(text = f"水平缩放: {props.sScaleHor}")
@@ -1528,6 +1688,8 @@ def register():
     bpy.utils.register_class(MY_OT_BottomMark)
     bpy.utils.register_class(MY_OT_ColorMountain)
     bpy.utils.register_class(MY_OT_ContourLines)
+    bpy.utils.register_class(MY_OT_TileCacheInfo)
+    bpy.utils.register_class(MY_OT_TileCacheTrim)
 
     
 
@@ -1552,6 +1714,8 @@ def unregister():
     bpy.utils.unregister_class(MY_OT_BottomMark)
     bpy.utils.unregister_class(MY_OT_ColorMountain)
     bpy.utils.unregister_class(MY_OT_ContourLines)
+    bpy.utils.unregister_class(MY_OT_TileCacheInfo)
+    bpy.utils.unregister_class(MY_OT_TileCacheTrim)
 
 
 
@@ -1677,247 +1841,474 @@ import xml.etree.ElementTree as ET
 from datetime import datetime
 import bpy
 
-def read_gpx_1_1(filepath):
+class Track:
     """
-    Reads a GPX file and extracts the coordinates, elevation, and timestamps
-    from either track points (trkpt) or route points (rtept).
+    Columnar GPS track: float64 lat/lon, float32 ele and int64 epoch seconds (NO_TIME where a point has
+    no timestamp). offsets holds the start index of every segment (track segment or file).
     """
-
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-
-    segmentlist = []
-    # Define namespaces for parsing GPX
-    ns = {'default': 'http://www.topografix.com/GPX/1/1'}
-
-    #find segments inside the file
-    segments = root.findall('.//default:trkseg',ns)
-    print(f"Segments: {len(segments)}")
-    if segments:
+    NO_TIME = np.iinfo(np.int64).min
+
+    def __init__(self, lat, lon, ele=None, time=None, offsets=None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        n = len(self.lat)
+        self.ele = np.zeros(n, dtype=np.float32) if ele is None else np.asarray(ele, dtype=np.float32)
+        self.time = np.full(n, self.NO_TIME, dtype=np.int64) if time is None else np.asarray(time, dtype=np.int64)
+        if offsets is None:
+            offsets = [0] if n else []
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def segment_count(self):
+        return len(self.offsets)
+
+    def segment_bounds(self):
+        """List of (start, end) index pairs, one per segment."""
+        ends = list(self.offsets[1:]) + [len(self)]
+        return list(zip(self.offsets.tolist(), [int(e) for e in ends]))
+
+    def split(self, values):
+        """Split a per-point array into one array per segment."""
+        return np.split(values, self.offsets[1:]) if self.segment_count else []
+
+    def has_time(self):
+        """Bool mask of the points that have a timestamp."""
+        return self.time != self.NO_TIME
+
+    def project(self, projection=None):
+        """Blender coordinates of every point as an (N, 3) float64 array."""
+        x, y, z = convert_to_blender_coordinates_array(self.lat, self.lon, self.ele, projection)
+        return np.column_stack((x, y, z))
+
+    @classmethod
+    def from_segments(cls, segments):
+        """Build a track from lists of (lat, lon, ele, datetime or None) tuples, one list per segment."""
+        lat, lon, ele, time, offsets = [], [], [], [], []
         for seg in segments:
-            # Try to find track points first
-            points = seg.findall('.//default:trkpt', ns)
-            point_type = 'trkpt'
-
-            # If no track points found, look for route points
-            if not points:
-                points = seg.findall('.//default:rtept', ns)
-                point_type = 'rtept'
-
-            segcoords = []
-            lowestElevation = 10000
-
-            for pt in points:
-                lat = float(pt.get('lat'))
-                lon = float(pt.get('lon'))
-                ele = pt.find('default:ele', ns)
-                elevation = float(ele.text) if ele is not None else 0.0
-                time = pt.find('default:time', ns)
-                try:
-                    timestamp = datetime.fromisoformat(time.text.replace("Z", "+00:00")) if time is not None else None
-                except Exception:
-                    timestamp = None
-                segcoords.append((lat, lon, elevation, timestamp))
-                if elevation < lowestElevation:
-                    lowestElevation = elevation
-
-            global elevationOffset
-            elevationOffset = max(lowestElevation - 50, 0)
-
-            bpy.context.scene.tp3d["sElevationOffset"] = elevationOffset
-            bpy.context.scene.tp3d["o_verticesPath"] = f"{point_type.upper()}  Path vertices: {len(segcoords)}"
-            segmentlist.append(segcoords)
+            if not seg:
+                continue
+            offsets.append(len(lat))
+            for p in seg:
+                lat.append(p[0])
+                lon.append(p[1])
+                ele.append(p[2])
+                time.append(epoch_seconds(p[3]) if len(p) > 3 and isinstance(p[3], datetime) else cls.NO_TIME)
+        return cls(lat, lon, ele, time, offsets)
+
+    @classmethod
+    def concat(cls, tracks):
+        """Join tracks end to end, keeping every segment."""
+        tracks = [t for t in tracks if len(t)]
+        if not tracks:
+            return cls([], [])
+        starts = np.cumsum([0] + [len(t) for t in tracks[:-1]])
+        return cls(
+            np.concatenate([t.lat for t in tracks]),
+            np.concatenate([t.lon for t in tracks]),
+            np.concatenate([t.ele for t in tracks]),
+            np.concatenate([t.time for t in tracks]),
+            np.concatenate([t.offsets + start for t, start in zip(tracks, starts)]),
+        )
 
-    #coordinates.append(segcoords)
-    return segmentlist
+def epoch_seconds(timestamp):
+    """datetime -> int epoch seconds. Naive datetimes are taken as UTC."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp())
+
+def track_arc_length(track):
+    """Cumulative distance in meters along the track; restarts at 0 at every segment start."""
+    step = np.zeros(len(track))
+    if len(track) > 1:
+        step[1:] = haversine_array(track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:]) * 1000
+    step[track.offsets] = 0
+    return step.cumsum() - np.repeat(step.cumsum()[track.offsets], np.diff(np.append(track.offsets, len(track))))
+
+def _resample_segment(track, start, end, s, targets):
+    """Interpolate one segment's columns at the arc-length positions in targets."""
+    seg_s = s[start:end]
+    lat = np.interp(targets, seg_s, track.lat[start:end])
+    lon = np.interp(targets, seg_s, track.lon[start:end])
+    ele = np.interp(targets, seg_s, track.ele[start:end].astype(np.float64))
+    seg_time = track.time[start:end]
+    if (seg_time != Track.NO_TIME).all():
+        time = np.rint(np.interp(targets, seg_s, seg_time.astype(np.float64))).astype(np.int64)
+    else:
+        #without a full set of timestamps every sample keeps the time of the point before it
+        time = seg_time[np.clip(np.searchsorted(seg_s, targets, side="right") - 1, 0, end - start - 1)]
+    return lat, lon, ele, time
 
+def resample_track(track, spacing=None, count=None, keep_vertices=False, return_inserted=False):
+    """
+    Resample every segment by linear interpolation along its arc length, carrying elevation and time along.
+    spacing gives the distance between samples in meters; count gives a total number of samples, shared
+    between the segments by length. With keep_vertices the original points are kept as well, so the shape
+    of the path does not change. With return_inserted a bool mask of the samples that are not original
+    points is returned as well.
+    """
+    if len(track) < 2 or (spacing is None and count is None):
+        return (track, np.zeros(len(track), dtype=bool)) if return_inserted else track
+    s = track_arc_length(track)
+    bounds = track.segment_bounds()
+    lengths = np.array([s[end - 1] for _, end in bounds])
+    total = lengths.sum()
+    if total <= 0:
+        return (track, np.zeros(len(track), dtype=bool)) if return_inserted else track
+
+    columns = ([], [], [], [])
+    inserted = []
+    offsets = []
+    out_len = 0
+    for (start, end), length in zip(bounds, lengths):
+        if length <= 0:
+            #a single point or a segment without any movement
+            targets = s[start:end]
+        else:
+            if spacing is not None:
+                n = int(np.ceil(length / spacing)) + 1
+            else:
+                n = max(2, int(round(count * length / total)))
+            targets = np.linspace(0.0, length, n)
+            if keep_vertices:
+                targets = np.union1d(targets, s[start:end])
+        for column, values in zip(columns, _resample_segment(track, start, end, s, targets)):
+            column.append(values)
+        inserted.append(~np.isin(targets, s[start:end]))
+        offsets.append(out_len)
+        out_len += len(targets)
+
+    lat, lon, ele, time = (np.concatenate(column) for column in columns)
+    resampled = Track(lat, lon, ele, time, offsets)
+    return (resampled, np.concatenate(inserted)) if return_inserted else resampled
+
+def read_gpx_stream(filepath):
+    """
+    Single pass GPX 1.0/1.1 reader built on iterparse.
+    The version is read from the root element, every trkseg becomes one segment as soon as it closes,
+    and processed elements are cleared so memory stays flat for very large files. Routes (rte) are only
+    used when the file has no track segments.
+    Returns (track, version, point_type, section_count).
+    """
+    #[lats, lons, eles, times, offsets, segment start] for track segments and for routes
+    track_parts = [[], [], [], [], [], 0]
+    route_parts = [[], [], [], [], [], 0]
+    lats, lons, eles, times = track_parts[:4]
+    section_count = 0
+    ele_text = None
+    time_text = None
+    container = None #the open trkseg/rte, finished points are removed from it
+    fromisoformat = datetime.fromisoformat
+    no_time = Track.NO_TIME
+
+    context = ET.iterparse(filepath, events=("start", "end"))
+    _, root = next(context)
+    version = root.get("version")
+    for event, elem in context:
+        tag = elem.tag
+        tag = tag[tag.rfind("}") + 1:]
+        if event == "start":
+            if tag == "trkseg" or tag == "rte":
+                container = elem
+                lats, lons, eles, times = (track_parts if tag == "trkseg" else route_parts)[:4]
+            continue
 
+        if tag == "ele":
+            ele_text = elem.text
+        elif tag == "time":
+            time_text = elem.text
+        elif tag == "trkpt" or tag == "rtept":
+            timestamp = no_time
+            if time_text:
+                try:
+                    timestamp = epoch_seconds(fromisoformat(time_text.replace("Z", "+00:00")))
+                except ValueError:
+                    pass
+            lats.append(float(elem.get("lat")))
+            lons.append(float(elem.get("lon")))
+            eles.append(float(ele_text) if ele_text else 0.0)
+            times.append(timestamp)
+            ele_text = None
+            time_text = None
+            elem.clear()
+            if container is not None and len(container) and container[-1] is elem:
+                del container[-1]
+        elif tag == "trkseg" or tag == "rte":
+            parts = track_parts if tag == "trkseg" else route_parts
+            if tag == "trkseg":
+                section_count += 1
+            if len(parts[0]) > parts[5]:
+                parts[4].append(parts[5])
+                parts[5] = len(parts[0])
+            elem.clear()
+            container = None
+        elif tag == "trk" or tag == "wpt" or tag == "metadata":
+            elem.clear()
+            ele_text = None
+            time_text = None
+
+    point_type = "trkpt"
+    parts = track_parts
+    if not track_parts[4] and route_parts[4]:
+        point_type = "rtept"
+        parts = route_parts
+    return Track(*parts[:5]), version, point_type, section_count
+
+def apply_track_elevation_offset(track, label):
+    """Set the elevation offset from the lowest point of the track and report the vertex count."""
+    lowestElevation = min(10000, float(track.ele.min())) if len(track) else 10000
 
+    global elevationOffset
+    elevationOffset = max(lowestElevation - 50, 0)
 
+    bpy.context.scene.tp3d["sElevationOffset"] = elevationOffset
+    bpy.context.scene.tp3d["o_verticesPath"] = f"{label}Path vertices: {len(track)}"
+
+def track_cache_path(filepath):
+    """Cache file for a source file. The name comes from the absolute path, size and mtime are checked on load."""
+    key = hashlib.sha1(os.path.abspath(filepath).encode("utf-8")).hexdigest()
+    return os.path.join(track_cache_dir, key + ".npz")
+
+def _track_cache_stamp(filepath):
+    stat = os.stat(filepath)
+    return np.array([TRACK_CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def load_cached_track(filepath):
+    """Returns (track, version, point_type, section_count) from the cache, or None if missing or out of date."""
+    cache_path = track_cache_path(filepath)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            if not np.array_equal(data["stamp"], _track_cache_stamp(filepath)):
+                return None
+            track = Track(data["lat"], data["lon"], data["ele"], data["time"], data["offsets"])
+            result = track, str(data["version"]), str(data["point_type"]), int(data["section_count"])
+    except Exception as e:
+        print(f"Ignoring unreadable track cache {cache_path}: {e}")
+        return None
+    #the access time orders the least recently used entries for trim_track_cache
+    try:
+        now = time.time()
+        os.utime(cache_path, (now, os.stat(cache_path).st_mtime))
+    except OSError:
+        pass
+    return result
 
-def read_gpx_1_0(filepath):
-    """Reads a GPX 1.0 file and extracts the coordinates, elevation, and timestamps."""
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-    
-    segmentlist = []
-    # Define the namespace to handle the GPX 1.0 format correctly
-    ns = {'gpx': 'http://www.topografix.com/GPX/1/0'}
+def store_cached_track(filepath, track, version, point_type, section_count):
+    """Write the parsed track next to the other cache entries. Written to a temp file first so readers never see half a file."""
+    cache_path = track_cache_path(filepath)
+    tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(track_cache_dir, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, stamp=_track_cache_stamp(filepath),
+                lat=track.lat, lon=track.lon, ele=track.ele, time=track.time, offsets=track.offsets,
+                version=np.str_(version or ""), point_type=np.str_(point_type), section_count=np.int64(section_count),
+            )
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write track cache {cache_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    # Extract track points (latitude, longitude, elevation, timestamp)
-    segcoords = []
-    lowestElevation = 10000
+def trim_track_cache(quota_bytes, target=0.9):
+    """
+    Delete least recently used track cache files until the cache is below target * quota_bytes.
+    Does nothing while the cache is within the quota. Returns (files removed, bytes freed).
+    """
+    removed = 0
+    freed = 0
+    with _track_cache_lock:
+        entries = []
+        try:
+            with os.scandir(track_cache_dir) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".npz"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+        except FileNotFoundError:
+            return removed, freed
+        total = sum(size for _, size, _ in entries)
+        if total <= quota_bytes:
+            return removed, freed
+        for _, size, path in sorted(entries):
+            if total <= quota_bytes * target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not remove cached track {path}: {e}")
+                continue
+            total -= size
+            removed += 1
+            freed += size
+    if removed:
+        print(f"Track cache: removed {removed} least recently used files ({freed / 2**20:.1f} MB)")
+    return removed, freed
+
+def track_cache_quota():
+    return bpy.context.scene.tp3d.get("trackCacheQuota", 256) * 2**20
+
+def read_gpx_cached(filepath):
+    """read_gpx_stream with the parsed result kept on disk until the file changes."""
+    cached = load_cached_track(filepath)
+    if cached is not None:
+        return cached
+    result = read_gpx_stream(filepath)
+    store_cached_track(filepath, *result)
+    return result
+
+IGC_B_RECORD_WIDTH = 35 #B HHMMSS DDMMmmmN DDDMMmmmE V PPPPP GGGGG
+
+def igc_flight_date(lines):
+    """Flight date from the HFDTE header (both 'HFDTEddmmyy' and 'HFDTEDATE:ddmmyy,nn'), or None."""
+    for line in lines:
+        if line.startswith(b"HFDTE"):
+            digits = bytes(c for c in line[5:] if 48 <= c <= 57)[:6]
+            if len(digits) == 6:
+                day, month, year = int(digits[0:2]), int(digits[2:4]), int(digits[4:6])
+                try:
+                    return datetime(2000 + year if year < 80 else 1900 + year, month, day, tzinfo=timezone.utc)
+                except ValueError:
+                    return None
+    return None
 
-    segments = root.findall('.//gpx:trkseg',ns)
-    print(f"Segments in 1.0: {len(segments)}")
-    
-                        
-    if segments:
-        for seg in segments:
-            # Extracting track points
-            for trkpt in seg.findall('.//gpx:trkpt', ns):
-                lat = float(trkpt.get('lat'))
-                lon = float(trkpt.get('lon'))
-                ele = trkpt.find('gpx:ele', ns)
-                elevation = float(ele.text) if ele is not None else 0.0
-                time = trkpt.find('gpx:time', ns)
-                timestamp = datetime.fromisoformat(time.text) if time is not None else None
-                #print(f"lat: {lat}, long: {lon}, ele: {elevation}, time: {timestamp}")
-                segcoords.append((lat, lon, elevation, timestamp))
-                
-                if elevation < lowestElevation:
-                    lowestElevation = elevation
-            
-            global elevationOffset
-            elevationOffset = max(lowestElevation - 50, 0)
+def read_igc(filepath, apply_offset=True):
+    """
+    Reads an IGC file and extracts the coordinates, elevation, and timestamps.
+    All B records are decoded at once from a fixed-width byte array; the date comes from the HFDTE header.
+    """
+    with open(filepath, 'rb') as file:
+        lines = file.read().splitlines()
+
+    # IGC B records contain position data
+    records = [line[:IGC_B_RECORD_WIDTH] for line in lines if line.startswith(b"B") and len(line) >= IGC_B_RECORD_WIDTH]
+    raw = np.frombuffer(b"".join(records), dtype=np.uint8).reshape(-1, IGC_B_RECORD_WIDTH)
+    digits = raw.astype(np.int64) - 48
+
+    def number(start, end):
+        value = np.zeros(len(raw), dtype=np.int64)
+        for col in range(start, end):
+            value = value * 10 + digits[:, col]
+        return value
+
+    # Altitudes may carry a leading minus sign
+    alt_negative = raw[:, 30] == ord("-")
+    alt_digits = digits[:, 30:35].copy()
+    alt_digits[:, 0] = np.where(alt_negative, 0, alt_digits[:, 0])
+    digit_cols = np.r_[1:14, 15:23]
+    valid = ((digits[:, digit_cols] >= 0) & (digits[:, digit_cols] <= 9)).all(axis=1)
+    valid &= ((alt_digits >= 0) & (alt_digits <= 9)).all(axis=1)
+    valid &= np.isin(raw[:, 14], (ord("N"), ord("S"))) & np.isin(raw[:, 23], (ord("E"), ord("W")))
+    if not valid.all():
+        print(f"Error parsing IGC file: skipped {int((~valid).sum())} B records")
+    raw, digits, alt_digits, alt_negative = raw[valid], digits[valid], alt_digits[valid], alt_negative[valid]
+
+    # Extract time (HHMMSS), times that go backwards roll over to the next day
+    seconds = number(1, 3) * 3600 + number(3, 5) * 60 + number(5, 7)
+    seconds += np.concatenate(([0], np.cumsum(np.diff(seconds) < 0))) * 86400
+
+    # Extract latitude (DDMMmmmN/S) and longitude (DDDMMmmmE/W)
+    lat = number(7, 9) + number(9, 14) / 60000.0
+    lat = np.where(raw[:, 14] == ord("S"), -lat, lat)
+    lon = number(15, 18) + number(18, 23) / 60000.0
+    lon = np.where(raw[:, 23] == ord("W"), -lon, lon)
+
+    # Use GPS altitude (in meters) for elevation
+    gps_alt = np.zeros(len(raw), dtype=np.int64)
+    for col in range(5):
+        gps_alt = gps_alt * 10 + alt_digits[:, col]
+    gps_alt = np.where(alt_negative, -gps_alt, gps_alt)
+
+    # IGC B records only hold the time of day, the date is taken once from the header
+    flight_date = igc_flight_date(lines)
+    if flight_date is None:
+        flight_date = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    time = epoch_seconds(flight_date) + seconds
+
+    offsets = [0] if len(lat) else []
+    track = Track(lat, lon, gps_alt, time, offsets)
+    if apply_offset:
+        apply_track_elevation_offset(track, "")
+    return track
+
+
+def read_track_file(filepath):
+    """Parse one .gpx or .igc file into a Track without touching any globals, so it can run in a worker thread."""
+    file_extension = os.path.splitext(filepath)[1].lower()
+    if file_extension == '.gpx':
+        track, version, _, _ = read_gpx_cached(filepath)
+        print(f"File Name: {os.path.basename(filepath)}, File Version: {version}")
+        return track
+    if file_extension == '.igc':
+        return read_igc(filepath, apply_offset=False)
+    return None
 
-            bpy.context.scene.tp3d["sElevationOffset"] = elevationOffset
-            
-            bpy.context.scene.tp3d["o_verticesPath"] = f"Path vertices: {len(segcoords)}"
-            segmentlist.append(segcoords)
-            
-    return segmentlist
-
-def read_igc(filepath):
-    """Reads an IGC file and extracts the coordinates, elevation, and timestamps."""
-    segmentlist = []
-    coordinates = []
-    lowestElevation = 10000
-    
-    with open(filepath, 'r') as file:
-        for line in file:
-            # IGC B records contain position data
-            if line.startswith('B'):
+def read_gpx_directory(directory_path, workers=None):
+    """
+    Reads all GPX files in a directory and extracts coordinates, elevation, and timestamps.
+    Files are parsed in a thread pool; a file that fails is reported and skipped instead of aborting the batch.
+    """
+    filepaths = [
+        os.path.join(directory_path, filename)
+        for filename in os.listdir(directory_path)
+        if filename.lower().endswith(".gpx")  # Only process .gpx files
+    ]
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+
+    tracks = [None] * len(filepaths)  # One track per file, in listing order
+    failed = {}
+    if filepaths:
+        with ThreadPoolExecutor(max_workers=min(workers, len(filepaths))) as pool:
+            futures = {pool.submit(read_track_file, filepath): i for i, filepath in enumerate(filepaths)}
+            for future in as_completed(futures):
+                i = futures[future]
                 try:
-                    # Extract time (HHMMSS)
-                    time_str = line[1:7]
-                    hours = int(time_str[0:2])
-                    minutes = int(time_str[2:4])
-                    seconds = int(time_str[4:6])
-                    
-                    # Extract latitude (DDMMmmmN/S)
-                    lat_str = line[7:15]
-                    lat_deg = int(lat_str[0:2])
-                    lat_min = int(lat_str[2:4])
-                    lat_min_frac = int(lat_str[4:7]) / 1000.0
-                    lat = lat_deg + (lat_min + lat_min_frac) / 60.0
-                    if lat_str[7] == 'S':
-                        lat = -lat
-                    
-                    # Extract longitude (DDDMMmmmE/W)
-                    lon_str = line[15:24]
-                    lon_deg = int(lon_str[0:3])
-                    lon_min = int(lon_str[3:5])
-                    lon_min_frac = int(lon_str[5:8]) / 1000.0
-                    lon = lon_deg + (lon_min + lon_min_frac) / 60.0
-                    if lon_str[8] == 'W':
-                        lon = -lon
-                    
-                    # Extract pressure altitude (in meters)
-                    pressure_alt = int(line[25:30])
-                    
-                    # Extract GPS altitude (in meters)
-                    gps_alt = int(line[30:35])
-                    
-                    # Create timestamp (using current date since IGC files don't store date in B records)
-                    now = datetime.now()
-                    timestamp = datetime(now.year, now.month, now.day, hours, minutes, seconds)
-                    
-                    # Use GPS altitude for elevation
-                    elevation = gps_alt
-                    
-                    coordinates.append((lat, lon, elevation, timestamp))
-                    
-                    if elevation < lowestElevation:
-                        lowestElevation = elevation
-                        
-                except (ValueError, IndexError) as e:
-                    print(f"Error parsing IGC line: {line.strip()}")
-                    continue
-    
-    global elevationOffset
-    elevationOffset = max(lowestElevation - 50, 0)
-    
-    bpy.context.scene.tp3d["o_verticesPath"] = "Path vertices: " + str(len(coordinates))
-
-    segmentlist.append(coordinates)
-    return segmentlist
-
-
-def read_gpx_directory(directory_path):
-    """Reads all GPX files in a directory and extracts coordinates, elevation, and timestamps."""
-    
-    # Define GPX namespace
-    ns = {'default': 'http://www.topografix.com/GPX/1/1'}
-    
-    # List to store all coordinates from all GPX files
-    coordinates = []
-    coordinatesSeparate = []  # Stores a list of lists for separate files
-    lowestElevation = 10000  # High initial value
-
-    # Iterate over all files in the directory
-    for filename in os.listdir(directory_path):
-        if filename.lower().endswith(".gpx"):  # Only process .gpx files
-            filepath = os.path.join(directory_path, filename)
-
-            file_extension = os.path.splitext(filepath)[1].lower()
-            if file_extension == '.gpx':
-                tree = ET.parse(filepath)
-                root = tree.getroot()
-                version = root.get("version")
-                print(f"File Name: {filename}, File Version: {version}")
-                if version == "1.0":
-                    co= read_gpx_1_0(filepath)
-                if version == "1.1":
-                    co= read_gpx_1_1(filepath)
-            elif file_extension == '.igc':
-                co= read_igc(filepath)
-
-            # Append the file-specific list to coordinatesSeparate
-            if co:
-                for coseg in co:
-                    coordinatesSeparate.append(coseg)
-                    lowest = min(coseg, key = lambda x: x[2])
-                    lowest_In_coords = lowest[2]
-                    if lowest_In_coords < lowestElevation:
-                        lowestElevation = lowest_In_coords
-                        print(f"new Lowest Elevation: {lowestElevation}")
-            
-    #Merge the separate coordinates to one big list together
-    coordinates = [pt for sublist in coordinatesSeparate for pt in sublist]
-    
-
-    # Calculate elevation offset
-    global elevationOffset
-    elevationOffset = max(lowestElevation - 50, 0)
+                    tracks[i] = future.result()
+                except Exception as e:
+                    failed[os.path.basename(filepaths[i])] = e
+                    print(f"Failed to read {filepaths[i]}: {e}")
 
-    bpy.context.scene.tp3d["sElevationOffset"] = elevationOffset
+    #Merge the separate files to one track, every file segment stays a segment
+    read = [(os.path.basename(path), t) for path, t in zip(filepaths, tracks) if t is not None and len(t)]
+    track = Track.concat([t for _, t in read])
+    global chainFiles
+    first_segments = np.cumsum([0] + [t.segment_count for _, t in read[:-1]]).tolist()
+    chainFiles = [(filename, int(first)) for (filename, _), first in zip(read, first_segments)] if read else []
 
-    # Store the number of points in the Blender scene property
-    bpy.context.scene.tp3d["o_verticesPath"] = f"Path vertices: {len(coordinates)}"
+    # Calculate elevation offset from the lowest point of all files
+    apply_track_elevation_offset(track, "")
+    trim_track_cache(track_cache_quota())
     
-    print(f"Total GPX files processed: {len(coordinatesSeparate)}")
+    print(f"Total GPX files processed: {track.segment_count}")
+    if failed:
+        show_message_box(f"{len(failed)}个文件无法读取：{', '.join(sorted(failed)[:5])}")
     
-    return coordinatesSeparate
+    return track
 
 def read_gpx_file():
 
-    coords = []
+    coords = Track([], [])
     file_extension = os.path.splitext(gpx_file_path)[1].lower()
     if file_extension == '.gpx':
-        tree = ET.parse(gpx_file_path)
-        root = tree.getroot()
-        version = root.get("version")
+        coords, version, point_type, sections = read_gpx_cached(gpx_file_path)
 
-        ns = {'default': root.tag.split('}')[0].strip('{')}
         global GPXsections
-        GPXsections = len(root.findall(".//default:trkseg", ns))
+        GPXsections = sections
         print(f"GPX Sections: {GPXsections}")
         
-        if version == "1.0":
-            coords = read_gpx_1_0(gpx_file_path)
-        if version == "1.1":
-            coords= read_gpx_1_1(gpx_file_path)
+        apply_track_elevation_offset(coords, f"{point_type.upper()}  " if version == "1.1" else "")
+        trim_track_cache(track_cache_quota())
     elif file_extension == '.igc':
         coords= read_igc(gpx_file_path)
     else:
@@ -1930,47 +2321,119 @@ def read_gpx_file():
     return coords
     
 
-# Load cache from disk
-def load_elevation_cache():
-    """Load the elevation cache from disk"""
-
-    global _elevation_cache
-    if os.path.exists(elevation_cache_file):
-        try:
-            with open(elevation_cache_file, "r") as f:
-                _elevation_cache = json.load(f)
-        except Exception as e:
-            print(f"Error loading elevation cache: {str(e)}")
-            _elevation_cache = {}
-    else:
-        _elevation_cache = {}
-
-# Save cache to disk
+def get_elevation_db():
+    """Open the SQLite elevation cache on first use and migrate the old JSON cache into it."""
+    global _elevation_db
+    if _elevation_db is not None:
+        return _elevation_db
+    con = sqlite3.connect(elevation_cache_db, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("CREATE TABLE IF NOT EXISTS providers (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS elevations ("
+        "provider INTEGER NOT NULL, lat INTEGER NOT NULL, lon INTEGER NOT NULL, "
+        "elevation REAL NOT NULL, atime REAL NOT NULL, "
+        "PRIMARY KEY (provider, lat, lon)) WITHOUT ROWID"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS elevations_atime ON elevations (atime)")
+    con.commit()
+    _elevation_db = con
+    migrate_json_elevation_cache()
+    return con
+
+def migrate_json_elevation_cache():
+    """One-time import of the old elevation_cache.json ("lat_lon_api" keys). The file is renamed afterwards."""
+    if not os.path.exists(elevation_cache_file):
+        return
+    try:
+        with open(elevation_cache_file, "r") as f:
+            old_cache = json.load(f)
+        by_provider = {}
+        for key, elevation in old_cache.items():
+            lat, lon, api_type = key.split("_", 2)
+            by_provider.setdefault(api_type, ([], []))
+            by_provider[api_type][0].append((float(lat), float(lon)))
+            by_provider[api_type][1].append(elevation if elevation is not None else 0)
+        for api_type, (coords, elevations) in by_provider.items():
+            store_cached_elevations(coords, elevations, api_type)
+        os.replace(elevation_cache_file, elevation_cache_file + ".migrated")
+        print(f"Migrated {len(old_cache)} cached elevations to {elevation_cache_db}")
+    except Exception as e:
+        print(f"Error migrating elevation cache: {str(e)}")
+
+def elevation_provider_id(con, api_type):
+    """Integer id of a provider name, created on first use."""
+    con.execute("INSERT OR IGNORE INTO providers (name) VALUES (?)", (api_type,))
+    return con.execute("SELECT id FROM providers WHERE name = ?", (api_type,)).fetchone()[0]
+
+def quantize_coords(coords):
+    """(N, 2) lat/lon array -> (N, 2) int64 array in 1e-5 degrees."""
+    return np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * ELEVATION_CACHE_SCALE).astype(np.int64)
+
+def lookup_cached_elevations(coords, api_type="opentopodata"):
+    """Batched cache lookup. Returns a float64 array with NaN where nothing is cached and refreshes the hits' access time."""
+    keys = quantize_coords(coords)
+    result = np.full(len(keys), np.nan)
+    if not len(keys):
+        return result
+    with _elevation_db_lock:
+        con = get_elevation_db()
+        provider = elevation_provider_id(con, api_type)
+        found = {}
+        now = time.time()
+        unique_keys = list(dict.fromkeys(map(tuple, keys.tolist())))
+        chunk = 400 #stay below the SQLite host parameter limit
+        for i in range(0, len(unique_keys), chunk):
+            part = unique_keys[i:i + chunk]
+            values = ",".join(["(?,?)"] * len(part))
+            params = [provider] + [v for key in part for v in key]
+            rows = con.execute(
+                f"SELECT lat, lon, elevation FROM elevations WHERE provider = ? AND (lat, lon) IN (VALUES {values})",
+                params).fetchall()
+            if rows:
+                con.execute(
+                    f"UPDATE elevations SET atime = ? WHERE provider = ? AND (lat, lon) IN (VALUES {values})",
+                    [now] + params)
+            for lat, lon, elevation in rows:
+                found[(lat, lon)] = elevation
+        con.commit()
+    if found:
+        result[:] = [found.get(key, np.nan) for key in map(tuple, keys.tolist())]
+    return result
+
+def store_cached_elevations(coords, elevations, api_type="opentopodata"):
+    """Batched insert of new elevations. Only the new rows are written."""
+    keys = quantize_coords(coords)
+    if not len(keys):
+        return
+    now = time.time()
+    with _elevation_db_lock:
+        con = get_elevation_db()
+        provider = elevation_provider_id(con, api_type)
+        con.executemany(
+            "INSERT OR REPLACE INTO elevations (provider, lat, lon, elevation, atime) VALUES (?, ?, ?, ?, ?)",
+            [(provider, lat, lon, float(ele), now) for (lat, lon), ele in zip(keys.tolist(), elevations)])
+        con.commit()
+
+# Trim the cache to its size limit
 def save_elevation_cache():
-    """Save the elevation cache to disk"""
-    # Limit cache size to prevent excessive file sizes
-    print(f"Currently cached:  {len(_elevation_cache)}")
-    if len(_elevation_cache) > cacheSize:
-        # Keep only the most recent entries
-        keys = list(_elevation_cache.keys())
-        for key in keys[:-cacheSize]:
-            del _elevation_cache[key]
-            
+    """Evict the least recently used elevations above cacheSize. Entries are already written when fetched."""
+    if _elevation_db is None:
+        return
     try:
-        with open(elevation_cache_file, "w") as f:
-            json.dump(_elevation_cache, f)
+        with _elevation_db_lock:
+            con = _elevation_db
+            count = con.execute("SELECT COUNT(*) FROM elevations").fetchone()[0]
+            print(f"Currently cached:  {count}")
+            if count > cacheSize:
+                con.execute(
+                    "DELETE FROM elevations WHERE (provider, lat, lon) IN "
+                    "(SELECT provider, lat, lon FROM elevations ORDER BY atime LIMIT ?)",
+                    (count - cacheSize,))
+                con.commit()
     except Exception as e:
-        print(f"Error saving elevation cache: {str(e)}")
-
-def get_cached_elevation(lat, lon, api_type="opentopodata"):
-    """Get elevation from cache if available"""
-    key = f"{lat:.5f}_{lon:.5f}_{api_type}"
-    return _elevation_cache.get(key)
-
-def cache_elevation(lat, lon, elevation, api_type="opentopodata"):
-    """Cache elevation data"""
-    key = f"{lat:.5f}_{lon:.5f}_{api_type}"
-    _elevation_cache[key] = elevation
+        print(f"Error trimming elevation cache: {str(e)}")
 
 def setupColors():
     #Create or get green material
@@ -2259,10 +2722,15 @@ def calculate_scale(mapSize, coordinates):
     #scalemode = bpy.context.scene.tp3d.get('scalemode',"SCALE")
     
     #for lat, lon, ele in coordinates:
-    min_lat = min(point[0] for point in coordinates)
-    max_lat = max(point[0] for point in coordinates)
-    min_lon = min(point[1] for point in coordinates)
-    max_lon = max(point[1] for point in coordinates)
+    if isinstance(coordinates, Track):
+        lats, lons = coordinates.lat, coordinates.lon
+    else:
+        lats = np.array([point[0] for point in coordinates])
+        lons = np.array([point[1] for point in coordinates])
+    min_lat = float(lats.min())
+    max_lat = float(lats.max())
+    min_lon = float(lons.min())
+    max_lon = float(lons.max())
     
     
     R = 6371  # Earth's radius in meters (Web Mercator standard)
@@ -2346,19 +2814,71 @@ def convert_to_geo(x,y):
     latitude = math.degrees(2 * math.atan(math.exp((y) / (R * scaleHor) )) - math.pi / 2)
     return latitude, longitude
 
+class ProjectionContext:
+    """
+    Snapshot of the values used to project between lat/lon and Blender coordinates.
+    Taking them once per batch avoids a scene property lookup for every point.
+    """
+    R = 6371  # Earth's radius in km (Web Mercator standard)
+
+    def __init__(self, scaleHor, elevationOffset=0, scaleElevation=1, autoScale=1):
+        self.scaleHor = scaleHor
+        self.elevationOffset = elevationOffset
+        self.scaleElevation = scaleElevation
+        self.autoScale = autoScale
+
+    @classmethod
+    def from_scene(cls):
+        """Capture the current horizontal scale and elevation settings."""
+        return cls(bpy.context.scene.tp3d.sScaleHor, elevationOffset, scaleElevation, autoScale)
+
+    def to_blender(self, lat, lon, elevation=0):
+        """Project lat/lon/elevation arrays to Blender x, y, z arrays."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        x = self.R * np.radians(lon) * self.scaleHor
+        y = self.R * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * self.scaleHor
+        z = (np.asarray(elevation, dtype=np.float64) - self.elevationOffset) / 1000 * self.scaleElevation * self.autoScale
+        return x, y, z + np.zeros_like(x)
+
+    def to_geo(self, x, y):
+        """Convert Blender x/y arrays back to latitude/longitude arrays."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        longitude = np.degrees(x / (self.R * self.scaleHor))
+        latitude = np.degrees(2 * np.arctan(np.exp(y / (self.R * self.scaleHor))) - np.pi / 2)
+        return latitude, longitude
+
+def convert_to_blender_coordinates_array(lat, lon, elevation=0, projection=None):
+    """Array version of convert_to_blender_coordinates. Returns (x, y, z) arrays."""
+    if projection is None:
+        projection = ProjectionContext.from_scene()
+    return projection.to_blender(lat, lon, elevation)
+
+def project_points(points, projection=None):
+    """Project a list of (lat, lon, ele, ...) points to a list of [x, y, z] Blender coordinates in one batch."""
+    if len(points) == 0:
+        return []
+    latlonele = np.array([p[:3] for p in points], dtype=np.float64)
+    x, y, z = convert_to_blender_coordinates_array(latlonele[:, 0], latlonele[:, 1], latlonele[:, 2], projection)
+    return np.column_stack((x, y, z)).tolist()
+
 def create_curve_from_coordinates(coordinates):
     """
-    Create a curve in Blender based on a list of (x, y, z) coordinates.
+    Create a curve in Blender based on an (N, 3) array (or list) of (x, y, z) coordinates.
     """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+
     # Create a new curve object
     curve_data = bpy.data.curves.new('GPX_Curve', type='CURVE')
     curve_data.dimensions = '3D'
     polyline = curve_data.splines.new('POLY')
     polyline.points.add(count=len(coordinates) - 1)
 
-    # Populate the curve with points
-    for i, coord in enumerate(coordinates):
-        polyline.points[i].co = (coord[0], coord[1], coord[2], 1)  # (x, y, z, w)
+    # Populate the curve with points in one call: (x, y, z, w)
+    co = np.ones((len(coordinates), 4), dtype=np.float32)
+    co[:, :3] = coordinates
+    polyline.points.foreach_set("co", co.ravel())
 
     # Create an object with this curve
     curve_object = bpy.data.objects.new('GPX_Curve_Object', curve_data)
@@ -2393,141 +2913,493 @@ def create_curve_from_coordinates(coordinates):
         #bpy.ops.object.convert(target='MESH')
         pass
 
-def simplify_curve(points_with_extra, min_distance=0.1000):
+def simplify_curve(points, min_distance=0.1000, fixed=None):
+    """
+    Removes points that are too close to the previously accepted point.
+    Takes and returns an (N, 3) array of Blender coordinates. Points flagged in fixed are always kept.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return points
+
+    xs, ys, zs = points[:, 0].tolist(), points[:, 1].tolist(), points[:, 2].tolist()
+    fixed = [False] * len(xs) if fixed is None else np.asarray(fixed, dtype=bool).tolist()
+    keep = [0]
+    lx, ly, lz = xs[0], ys[0], zs[0]
+    min_sq = min_distance * min_distance
+    for i in range(1, len(xs)):
+        dx = xs[i] - lx
+        dy = ys[i] - ly
+        dz = zs[i] - lz
+        if fixed[i] or dx * dx + dy * dy + dz * dz >= min_sq:
+            keep.append(i)
+            lx, ly, lz = xs[i], ys[i], zs[i]
+
+    return points[keep]
+
+def path_tolerance():
+    """Simplification tolerance in printed millimetres: deviations below half a nozzle width or a quarter of the path thickness cannot be printed."""
+    return min(nozzleWidth / 2, pathThickness / 4)
+
+def _segment_distances(points, a, b):
+    """Distance of every point to the segment a[i]-b[i] (all (N, 3) arrays)."""
+    ab = b - a
+    ab_len2 = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", points - a, ab) / np.where(ab_len2 > 0, ab_len2, 1)
+    closest = a + np.clip(t, 0, 1)[:, None] * ab
+    return np.linalg.norm(points - closest, axis=1)
+
+def douglas_peucker_mask(points, tolerance, fixed=None):
+    """
+    Douglas-Peucker keep mask. All open spans are split in the same pass, so every iteration is one
+    set of array operations over the points that are still undecided. Points flagged in fixed are
+    always kept and act as span ends from the start.
     """
-    Removes points that are too close to any previously accepted point.
-    Keeps the full (x, y, z, time) format.
+    n = len(points)
+    keep = np.zeros(n, dtype=bool) if fixed is None else np.array(fixed, dtype=bool)
+    keep[[0, n - 1]] = True
+    active = np.flatnonzero(~keep)
+    while len(active):
+        kept = np.flatnonzero(keep)
+        span = np.searchsorted(kept, active) - 1
+        start, end = kept[span], kept[span + 1]
+        dist = _segment_distances(points[active], points[start], points[end])
+        #active is sorted, so every span is one contiguous run
+        first = np.flatnonzero(np.r_[True, span[1:] != span[:-1]])
+        span_max = np.maximum.reduceat(dist, first)
+        run_max = np.repeat(span_max, np.diff(np.r_[first, len(active)]))
+        split = (dist == run_max) & (dist > tolerance)
+        #only the first farthest point of a span
+        split_idx = active[split]
+        split_span = span[split]
+        split_idx = split_idx[np.r_[True, split_span[1:] != split_span[:-1]]] if len(split_idx) else split_idx
+        keep[split_idx] = True
+        #points in spans that had no split are done
+        open_spans = np.isin(span, split_span)
+        active = active[open_spans & ~keep[active]]
+    return keep
+
+def visvalingam_mask(points, tolerance, fixed=None):
     """
+    Visvalingam-Whyatt keep mask. Each pass removes every point whose triangle area is below tolerance²
+    and smaller than the areas of both neighbours, so no two neighbours are removed in the same pass.
+    Points flagged in fixed are never removed.
+    """
+    n = len(points)
+    idx = np.arange(n)
+    fixed = np.zeros(n, dtype=bool) if fixed is None else np.asarray(fixed, dtype=bool)
+    min_area = tolerance * tolerance
+    while len(idx) > 2:
+        p = points[idx]
+        area = np.full(len(idx), np.inf)
+        area[1:-1] = 0.5 * np.linalg.norm(np.cross(p[:-2] - p[1:-1], p[2:] - p[1:-1]), axis=1)
+        left = np.r_[np.inf, area[:-1]]
+        right = np.r_[area[1:], np.inf]
+        remove = (area < min_area) & (area <= left) & (area < right) & ~fixed[idx]
+        if not remove.any():
+            break
+        idx = idx[~remove]
+    keep = np.zeros(n, dtype=bool)
+    keep[idx] = True
+    return keep
 
-    if not points_with_extra:
-        return []
+def simplify_path(points, tolerance=None, method=None, fixed=None):
+    """
+    Simplify an (N, 3) array of Blender coordinates; tolerance is in millimetres (Blender units).
+    Points flagged in the bool mask fixed are always kept (e.g. the samples added by resample_track).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    tolerance = path_tolerance() if tolerance is None else tolerance
+    method = simplifyMethod if method is None else method
+    if len(points) < 3:
+        return points
+    if method == "DISTANCE":
+        simplified = simplify_curve(points, tolerance, fixed)
+    elif method == "VISVALINGAM":
+        simplified = points[visvalingam_mask(points, tolerance, fixed)]
+    else:
+        simplified = points[douglas_peucker_mask(points, tolerance, fixed)]
+    print(f"Smooth curve: Removed {len(points) - len(simplified)} vertices ({method}, {tolerance:.3f}mm)")
+    return simplified
 
-    simplified = [points_with_extra[0]]
-    last_xyz = Vector(points_with_extra[0][:3])
-    skipped = 0
+def fill_mesh_from_arrays(mesh, verts, faces):
+    """Writes an (N, 2) or (N, 3) vertex array and an (F, k) face index array into an empty mesh."""
+    verts = np.asarray(verts, dtype=np.float32)
+    if verts.shape[1] == 2:
+        verts = np.column_stack((verts, np.zeros(len(verts), dtype=np.float32)))
+    faces = np.asarray(faces, dtype=np.int32)
+
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set("vertex_index", faces.ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, faces.shape[1], dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+def build_mesh_from_arrays(mesh_name, verts, faces):
+    """Creates a mesh object from an (N, 2) or (N, 3) vertex array and an (F, k) face index array."""
+    mesh = bpy.data.meshes.new(mesh_name)
+    fill_mesh_from_arrays(mesh, verts, faces)
+
+    obj = bpy.data.objects.new(mesh_name, mesh)
+    bpy.context.collection.objects.link(obj)
+    bpy.context.view_layer.objects.active = obj
+    return obj
 
-    for pt in points_with_extra[1:]:
-        current_xyz = Vector(pt[:3])
-        if (current_xyz - last_xyz).length >= min_distance:
-            simplified.append(pt)
-            last_xyz = current_xyz
-        else:
-            skipped += 1
-            pass
+def hexagon_grid(size, subdivisions):
+    """
+    Triangular lattice clipped to a hexagon with corners at 0, 60, ... 300 degrees.
+    Each hexagon edge is split into 2^subdivisions segments, the same density repeated subdividing gives.
+    Returns (verts (N, 2), faces (F, 3), lattice).
+    """
+    k = 2 ** subdivisions
+    step = size / k
+    i, j = np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1), indexing="ij")
+    inside = np.maximum(np.maximum(np.abs(i), np.abs(j)), np.abs(i + j)) <= k
+
+    index = np.full(i.shape, -1, dtype=np.int64)
+    index[inside] = np.arange(np.count_nonzero(inside))
+    verts = np.column_stack((step * (i[inside] + j[inside] / 2), step * j[inside] * math.sqrt(3) / 2))
+
+    a = index[:-1, :-1]  # (i, j)
+    b = index[1:, :-1]   # (i + 1, j)
+    c = index[:-1, 1:]   # (i, j + 1)
+    d = index[1:, 1:]    # (i + 1, j + 1)
+    up = np.column_stack((a.ravel(), b.ravel(), c.ravel()))
+    down = np.column_stack((b.ravel(), d.ravel(), c.ravel()))
+    faces = np.concatenate((up, down))
+    faces = faces[(faces >= 0).all(axis=1)]
+
+    # In axial index space the hexagon is two squares and two right triangles, all with legs of length k
+    roots = np.array([
+        [(k, 0), (0, k), (0, 0)],
+        [(-k, 0), (0, -k), (0, 0)],
+        [(0, 0), (k, -k), (k, 0)],
+        [(0, 0), (k, -k), (0, -k)],
+        [(0, 0), (-k, k), (-k, 0)],
+        [(0, 0), (-k, k), (0, k)],
+    ]) + k
+    return verts, faces, (index, roots, None)
+
+def rectangle_grid(width, height, subdivisions):
+    """Regular (2^subdivisions + 1)^2 vertex grid over a width x height rectangle. Returns (verts, quad faces, lattice)."""
+    m = 2 ** subdivisions
+    xs = np.linspace(-width / 2, width / 2, m + 1)
+    ys = np.linspace(-height / 2, height / 2, m + 1)
+    gx, gy = np.meshgrid(xs, ys)
+    verts = np.column_stack((gx.ravel(), gy.ravel()))
+    faces = quad_grid_faces(m + 1, m + 1)
+    return verts, faces, square_lattice(m) + (None,)
+
+def circle_grid(radius, num_segments, subdivisions):
+    """
+    Quad grid mapped onto a disc, matching the layout fill_grid produces on a circle of num_segments vertices
+    (corners on the x/y axes) followed by repeated subdivision. Returns (verts, quad faces, lattice).
+    """
+    m = max(num_segments // 4, 1) * 2 ** subdivisions
+    u, v = np.meshgrid(np.linspace(-1, 1, m + 1), np.linspace(-1, 1, m + 1))
+    # Elliptical square-to-disc mapping keeps the outer ring exactly on the circle
+    dx = u * np.sqrt(1 - v * v / 2)
+    dy = v * np.sqrt(1 - u * u / 2)
+    # Rotate by 45 degrees so the grid corners sit on the axes like fill_grid
+    c = math.sqrt(0.5)
+    verts = np.column_stack(((dx - dy).ravel() * c, (dx + dy).ravel() * c)) * radius
+    faces = quad_grid_faces(m + 1, m + 1)
+
+    # The outer ring follows the curved outline, so it must survive terrain simplification
+    ring = np.ones((m + 1, m + 1), dtype=bool)
+    ring[1:-1, 1:-1] = False
+    return verts, faces, square_lattice(m) + (ring,)
+
+def square_lattice(m):
+    """Vertex index grid and the two RTIN root triangles of an (m + 1)^2 row-major grid."""
+    index = np.arange((m + 1) ** 2).reshape(m + 1, m + 1)
+    roots = np.array([
+        [(0, 0), (m, m), (m, 0)],
+        [(0, 0), (m, m), (0, m)],
+    ])
+    return index, roots
+
+def quad_grid_faces(rows, cols):
+    """Counter-clockwise quad faces for a row-major rows x cols vertex grid."""
+    index = np.arange(rows * cols).reshape(rows, cols)
+    return np.column_stack((
+        index[:-1, :-1].ravel(),
+        index[:-1, 1:].ravel(),
+        index[1:, 1:].ravel(),
+        index[1:, :-1].ravel(),
+    ))
+
+def rtin_children(a, b, c):
+    """Splits right triangles (hypotenuse a-b, right angle at c) at the hypotenuse midpoint."""
+    m = (a + b) // 2
+    return np.concatenate((a, c)), np.concatenate((c, b)), np.concatenate((m, m))
+
+def rtin_triangle_offsets(u, v):
+    """
+    Grid offsets (relative to the right angle) of every lattice point inside the right triangle with legs u and v,
+    with their barycentric weights (s, t) along u and v.
+    """
+    corners = np.array([(0, 0), u, v])
+    lo, hi = corners.min(axis=0), corners.max(axis=0)
+    dx, dy = np.meshgrid(np.arange(lo[0], hi[0] + 1), np.arange(lo[1], hi[1] + 1), indexing="ij")
+    dx, dy = dx.ravel(), dy.ravel()
+    det = u[0] * v[1] - u[1] * v[0]
+    s = (dx * v[1] - dy * v[0]) / det
+    t = (u[0] * dy - u[1] * dx) / det
+    inside = (s >= -1e-9) & (t >= -1e-9) & (s + t <= 1 + 1e-9)
+    return np.column_stack((dx[inside], dy[inside])), s[inside], t[inside]
+
+def rtin_triangle_errors(flat_h, width, a, b, c):
+    """Largest vertical distance between the grid points inside each triangle and the triangle's plane."""
+    err = np.zeros(len(a), dtype=np.float64)
+    legs = np.concatenate((a - c, b - c), axis=1)
+    shapes, group = np.unique(legs, axis=0, return_inverse=True)
+    group = group.ravel()
+    for g, (u0, u1, v0, v1) in enumerate(shapes):
+        sel = np.flatnonzero(group == g)
+        offsets, s, t = rtin_triangle_offsets((u0, u1), (v0, v1))
+        ha = flat_h[a[sel, 0] * width + a[sel, 1]][:, None]
+        hb = flat_h[b[sel, 0] * width + b[sel, 1]][:, None]
+        hc = flat_h[c[sel, 0] * width + c[sel, 1]][:, None]
+        points = c[sel][:, None, :] + offsets[None]
+        h = flat_h[points[..., 0] * width + points[..., 1]]
+        err[sel] = np.abs(h - (hc + s * (ha - hc) + t * (hb - hc))).max(axis=1)
+    return err
+
+def rtin_vertex_errors(heights, roots, forced=None):
+    """
+    Right-triangulated irregular network error pass (Martini style).
+    heights is a 2D grid, roots an (R, 3, 2) array of root triangles (a, b, c) in grid index space.
+    Grid points marked in the optional forced mask are always kept.
+    Returns a grid holding, for every hypotenuse midpoint, the largest vertical error that keeping its
+    triangles unsplit would introduce. Every grid point inside a triangle is measured against the
+    triangle's plane, so the bound holds for the whole heightfield, not only the dropped midpoints.
+    """
+    errors = np.zeros(heights.shape, dtype=np.float64)
+    if forced is not None:
+        errors[forced] = np.inf
+    flat_h = heights.ravel()
+    width = heights.shape[1]
+
+    # Collect every level of the hierarchy, coarse to fine
+    levels = []
+    a, b, c = roots[:, 0], roots[:, 1], roots[:, 2]
+    while len(a):
+        splittable = ((a + b) % 2 == 0).all(axis=1)
+        a, b, c = a[splittable], b[splittable], c[splittable]
+        if not len(a):
+            break
+        levels.append((a, b, c))
+        a, b, c = rtin_children(a, b, c)
+
+    flat_err = errors.ravel()
+    for a, b, c in reversed(levels):
+        m = (a + b) // 2
+        im = m[:, 0] * width + m[:, 1]
+        err = rtin_triangle_errors(flat_h, width, a, b, c)
+        # Errors of the two child midpoints (only where the children can be split again)
+        for p in (a, b):
+            child_mid2 = p + c
+            valid = (child_mid2 % 2 == 0).all(axis=1)
+            child_mid = child_mid2 // 2
+            ic = child_mid[:, 0] * width + child_mid[:, 1]
+            err = np.where(valid, np.maximum(err, flat_err[ic]), err)
+        np.maximum.at(flat_err, im, err)
+    return errors
+
+def rtin_triangles(errors, roots, max_error):
+    """Extracts the crack-free triangle set whose vertical error stays within max_error. Returns (F, 3, 2) grid indices."""
+    width = errors.shape[1]
+    flat_err = errors.ravel()
+    result = []
+    a, b, c = roots[:, 0], roots[:, 1], roots[:, 2]
+    while len(a):
+        splittable = ((a + b) % 2 == 0).all(axis=1)
+        m = (a + b) // 2
+        split = splittable & (flat_err[m[:, 0] * width + m[:, 1]] > max_error)
+        keep = ~split
+        result.append(np.stack((a[keep], b[keep], c[keep]), axis=1))
+        a, b, c = rtin_children(a[split], b[split], c[split])
+    return np.concatenate(result)
+
+def simplify_terrain_mesh(obj, max_error):
+    """
+    Rebuilds the top surface of a freshly generated map with an RTIN that stays within max_error (mm)
+    of the sampled heightfield. Uses the grid layout recorded by create_hexagon/rectangle/circle.
+    """
+    if terrainLattice is None:
+        return
+    index, roots, forced = terrainLattice
+    mesh = obj.data
+    vertex_count = len(mesh.vertices)
+    if index.max() + 1 != vertex_count:
+        print("Terrain simplification skipped: mesh does not match the generated grid")
+        return
 
-    print(f"Smooth curve: Removed {skipped} vertices")
-    return simplified
+    co = np.empty(vertex_count * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
 
-def create_hexagon(size):
-    """Creates a hexagon at (0,0,0), subdivides it, and rotates it by 90 degrees."""
-    global num_subdivisions
-    verts = []
-    faces = []
+    heights = np.where(index >= 0, co[:, 2][np.maximum(index, 0)], 0.0)
+    errors = rtin_vertex_errors(heights, roots, forced)
+    tris = rtin_triangles(errors, roots, max_error)
+    faces = index[tris[:, :, 0], tris[:, :, 1]]
 
-    for i in range(6):
-        angle = math.radians(60 * i)
-        x = size * math.cos(angle)
-        y = size * math.sin(angle)
-        verts.append((x, y, 0))
-    verts.append((0, 0, 0))  # Center vertex
-    faces = [[i, (i + 1) % 6, 6] for i in range(6)]
-    mesh = bpy.data.meshes.new("Hexagon")
-    obj = bpy.data.objects.new("Hexagon", mesh)
-    bpy.context.collection.objects.link(obj)
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
-    bpy.context.view_layer.objects.active = obj
-    bpy.ops.object.mode_set(mode='EDIT')
-    #bpy.ops.mesh.subdivide(number_cuts=num_subdivisions)
-    for _ in range(num_subdivisions):
-        bpy.ops.mesh.subdivide(number_cuts=1)  # 1 cut per loop for even refinement
-    bpy.ops.object.mode_set(mode='OBJECT')
-    obj.name = name
-    obj.data.name = name
+    # Keep only the vertices that are used and make every face counter-clockwise (normals up)
+    used, faces = np.unique(faces, return_inverse=True)
+    faces = faces.reshape(-1, 3)
+    verts = co[used]
+    p = verts[faces]
+    cross = (p[:, 1, 0] - p[:, 0, 0]) * (p[:, 2, 1] - p[:, 0, 1]) - (p[:, 1, 1] - p[:, 0, 1]) * (p[:, 2, 0] - p[:, 0, 0])
+    faces[cross < 0] = faces[cross < 0][:, ::-1]
+
+    mesh.clear_geometry()
+    fill_mesh_from_arrays(mesh, verts, faces)
+    print(f"Simplified terrain: {vertex_count} -> {len(verts)} vertices, {len(faces)} triangles")
+
+def create_hexagon(size):
+    """Creates a subdivided hexagon at (0,0,0) directly from a triangular grid."""
+    global num_subdivisions, terrainLattice
+    verts, faces, terrainLattice = hexagon_grid(size, num_subdivisions)
+    obj = build_mesh_from_arrays(name, verts, faces)
     return obj
 
 def create_rectangle(width, height):
-    """Creates a rectangle at (0,0,0), subdivides it, and rotates it by 90 degrees."""
-    global num_subdivisions
-
-    verts = [
-        (-width / 2, -height / 2, 0),  # Bottom-left
-        (width / 2, -height / 2, 0),   # Bottom-right
-        (width / 2, height / 2, 0),    # Top-right
-        (-width / 2, height / 2, 0)    # Top-left
-    ]
-    faces = [[0, 1, 2, 3]]
-    mesh = bpy.data.meshes.new("Rectangle")
-    obj = bpy.data.objects.new("Rectangle", mesh)
-    bpy.context.collection.objects.link(obj)
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
-    bpy.context.view_layer.objects.active = obj
-    bpy.ops.object.mode_set(mode='EDIT')
-    for _ in range(num_subdivisions):
-        bpy.ops.mesh.subdivide(number_cuts=1)  # 1 cut per loop for even refinement
-    #bpy.ops.mesh.subdivide(number_cuts=num_subdivisions)  # Can change number of subdivisions if needed
-    bpy.ops.object.mode_set(mode='OBJECT')
-    obj.name = name
-    obj.data.name = name
-    
+    """Creates a subdivided rectangle at (0,0,0) directly from a regular grid."""
+    global num_subdivisions, terrainLattice
+    verts, faces, terrainLattice = rectangle_grid(width, height, num_subdivisions)
+    obj = build_mesh_from_arrays(name, verts, faces)
     return obj
 
 
 
 def create_circle(radius, num_segments=64):
-    
+    """Creates a subdivided circle at (0,0,0) directly from a grid mapped onto the disc."""
     # Ensure we are in Object Mode
     try:
         bpy.ops.object.mode_set(mode='OBJECT')
     except:
         pass
 
-    # Create a new mesh and object
-    mesh = bpy.data.meshes.new(name)
-    obj = bpy.data.objects.new(name, mesh)
-    
-
-    # Link object to the scene collection
-    bpy.context.collection.objects.link(obj)
-
-    # Generate circle vertices
-    verts = []
-    faces = []
-    
-    for i in range(num_segments):
-        angle = math.radians(360 * i / num_segments)
-        x = radius * math.cos(angle)
-        y = radius * math.sin(angle)
-        verts.append((x, y, 0))
+    global terrainLattice
+    verts, faces, terrainLattice = circle_grid(radius, num_segments, num_subdivisions)
+    obj = build_mesh_from_arrays(name, verts, faces)
+    return obj
 
-    # Create edges between consecutive points
-    edges = [(i, (i + 1) % num_segments) for i in range(num_segments)]
 
-    # Create the mesh from data
-    mesh.from_pydata(verts, edges, [])  # No center vertex, no faces yet
-    mesh.update()
 
-    # Make the object active and switch to Edit Mode
-    bpy.context.view_layer.objects.active = obj
-    bpy.ops.object.mode_set(mode='EDIT')
 
-    # Select all vertices and fill the circle
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.fill_grid()
-    
-    #bpy.ops.mesh.subdivide(number_cuts=max(int(num_subdivisions/15),0))
-    for _ in range(num_subdivisions):
-        bpy.ops.mesh.subdivide(number_cuts=1)  # 1 cut per loop for even refinement
 
-    # Switch back to Object Mode
-    bpy.ops.object.mode_set(mode='OBJECT')
+class TokenBucket:
+    """Thread-safe token bucket: up to `burst` requests back to back, `rate` requests per second on average."""
 
-    return obj
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
+    def configure(self, rate, burst):
+        """Change rate/burst without resetting the tokens already spent."""
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
 
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_rate_limiter(provider):
+    """Shared token bucket for an elevation API, configured from the scene settings."""
+    props = bpy.context.scene.tp3d
+    if provider == "opentopodata":
+        rate, burst = props.get("rateOpenTopoData", 1.0), props.get("burstOpenTopoData", 1)
+    else:
+        rate, burst = props.get("rateOpenElevation", 0.5), props.get("burstOpenElevation", 1)
+    limiter = _rate_limiters.get(provider)
+    if limiter is None:
+        limiter = _rate_limiters[provider] = TokenBucket(rate, burst)
+    else:
+        limiter.configure(rate, burst)
+    return limiter
 
+def pipelined_requests(batches, send, limiter):
+    """
+    Runs send(batch) for every batch on one background worker, rate limited by limiter, and yields
+    (batch, result) in order. The next request is already in flight while the caller handles the current one.
+    """
+    def run(batch):
+        limiter.acquire()
+        return send(batch)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for batch in batches:
+            future = executor.submit(run, batch)
+            if pending is not None:
+                yield pending[0], pending[1].result()
+            pending = (batch, future)
+        if pending is not None:
+            yield pending[0], pending[1].result()
+
+API_RETRIES = 4 #extra attempts after an HTTP 429 (Too Many Requests)
+
+def send_with_backoff(send):
+    """
+    Call send() until the response is not HTTP 429, waiting for the Retry-After header or 1, 2, 4, 8 s
+    between attempts. Raises for an error status once the retries are used up.
+    """
+    for attempt in range(API_RETRIES + 1):
+        response = send()
+        if response.status_code != 429 or attempt == API_RETRIES:
+            break
+        retry_after = response.headers.get("Retry-After", "")
+        wait = min(float(retry_after), 60) if retry_after.isdigit() else 2 ** attempt
+        print(f"Rate limited by the elevation API, retrying in {wait:.0f} s")
+        time.sleep(wait)
+    response.raise_for_status()
+    return response
+
+def fetch_openTopoData_batch(batch):
+    """One OpenTopoData request for a list of (lat, lon, ...) points. Returns the parsed JSON."""
+    query = "|".join([f"{c[0]},{c[1]}" for c in batch])
+    url = f"{opentopoAdress}{dataset}?locations={query}"
+    return send_with_backoff(lambda: requests.get(url)).json()
+
+def fetch_openElevation_batch(batch):
+    """One Open-Elevation request for a list of (lat, lon, ...) points. Returns the parsed JSON."""
+    # Open-Elevation expects a POST request with JSON body
+    payload = {"locations": [{"latitude": c[0], "longitude": c[1]} for c in batch]}
+    url = "https://api.open-elevation.com/api/v1/lookup"
+    headers = {'Content-Type': 'application/json'}
+    return send_with_backoff(lambda: requests.post(url, json=payload, headers=headers)).json()
+
+def numbered_batches(coords, batch_size, label):
+    """Split coords into batches, logging each one as an API request (label receives the running point count)."""
+    for i in range(0, len(coords), batch_size):
+        batch = coords[i:i + batch_size]
+        yield (i, batch, label(i + len(batch)))
 
+def logged(fetch):
+    """Wrap a batch fetcher so every request is counted and printed when it is sent."""
+    def send(numbered):
+        i, batch, addition = numbered
+        send_api_request(addition)
+        return fetch(batch)
+    return send
 
 # Get real elevation for a point
 def get_elevation_single(lat, lon):
@@ -2543,29 +3415,20 @@ def get_elevation_openTopoData(coords, lenv = 0, pointsDone = 0):
 
     disableCache = bpy.context.scene.tp3d.get("disableCache",0)
 
-    # Ensure the cache is loaded
-    if not _elevation_cache:
-        load_elevation_cache()
-
-    # First, check which coordinates need fetching (not in cache)
-    coords_to_fetch = []
-    coords_indices = []
-
     elevations = [0] * len(coords)  # Pre-allocate list
 
-
-    
-    #check if coordinates are in cache or not
-    for i, (lat, lon) in enumerate(coords):
-        cached_elevation = get_cached_elevation(lat, lon)
-        if cached_elevation is not None and disableCache == 0:
-            # Use cached elevation
-            elevations[i] = cached_elevation
-        else:
-            # Need to fetch this coordinate
-            elevations[i] = -5
-            coords_to_fetch.append((lat, lon))
-            coords_indices.append(i)
+    #check which coordinates are in cache (one batched lookup)
+    if disableCache == 0:
+        cached = lookup_cached_elevations(coords)
+    else:
+        cached = np.full(len(coords), np.nan)
+    missing = np.isnan(cached)
+    coords_indices = np.flatnonzero(missing).tolist()
+    coords_to_fetch = [tuple(coords[i]) for i in coords_indices]
+    for i in np.flatnonzero(~missing).tolist():
+        elevations[i] = float(cached[i])
+    for i in coords_indices:
+        elevations[i] = -5
 
     if len(coords) - len(coords_to_fetch) > 0:
         print(f"Using: {len(coords) - len(coords_to_fetch)} cached Coordinates")
@@ -2574,39 +3437,19 @@ def get_elevation_openTopoData(coords, lenv = 0, pointsDone = 0):
     if not coords_to_fetch:
         return elevations
     
-    #coords = [convert_to_geo(y, x, v[0], v[1]) for v in vertices]
-    #elevations = []
     batch_size = 100
-    for i in range(0, len(coords_to_fetch), batch_size):
-        batch = coords_to_fetch[i:i + batch_size]
-        query = "|".join([f"{c[0]},{c[1]}" for c in batch])
-        url = f"{opentopoAdress}{dataset}?locations={query}"
-        #print(url)
-        last_request_time = time.monotonic()
-        response = requests.get(url)
-        nr = i + len(batch) + pointsDone
-        addition = f" {nr}/{int(lenv)}"
-        send_api_request(addition)
-        response.raise_for_status()
-        
-        
-        data = response.json()
+    batches = numbered_batches(coords_to_fetch, batch_size, lambda n: f" {n + pointsDone}/{int(lenv)}")
+    for (i, batch, _), data in pipelined_requests(batches, logged(fetch_openTopoData_batch), get_rate_limiter("opentopodata")):
         # Handle the elevation data and replace 'null' with 0
+        batch_elevations = []
         for o, result in enumerate(data['results']):
             elevation = result.get('elevation', None)  # Safe get, default to None if key is missing
             if elevation is None:
                 elevation = 0  # Replace None (null in JSON) with 0
-            cache_elevation(batch[o][0], batch[o][1], elevation)
+            batch_elevations.append(elevation)
             ind = coords_indices[i+o]
             elevations[ind] = elevation
-        
-        # Get current time
-        now = time.monotonic()  # Monotonic time is safer for measuring elapsed time
-        elapsed_time = now - last_request_time
-        if i + batch_size < len(coords_to_fetch) and elapsed_time < 1.3:
-            time.sleep(1.3 - elapsed_time)  # Pause to prevent request throttling
-
-
+        store_cached_elevations(batch[:len(batch_elevations)], batch_elevations)
 
     return elevations
 
@@ -2615,89 +3458,489 @@ def get_elevation_openElevation(coords, lenv = 0, pointsDone = 0):
     
     elevations = []
     batch_size = 1000
-    for i in range(0, len(coords), batch_size):
-        batch = coords[i:i + batch_size]
-        # Open-Elevation expects a POST request with JSON body
-        payload = {"locations": [{"latitude": c[0], "longitude": c[1]} for c in batch]}
-        url = "https://api.open-elevation.com/api/v1/lookup"
-        last_request_time = time.monotonic()
-        
-        headers = {'Content-Type': 'application/json'}
-        nr = i + len(batch) + pointsDone
-        addition = f" {nr}/{int(lenv)}"
-        send_api_request(addition)
-        
-        response = requests.post(url, json=payload, headers=headers)
-        
-        #print(url)
-        #print(payload)
-        
-        response.raise_for_status()
-
-        data = response.json()
-        
-        
+    batches = numbered_batches(coords, batch_size, lambda n: f" {n + pointsDone}/{int(lenv)}")
+    for _, data in pipelined_requests(batches, logged(fetch_openElevation_batch), get_rate_limiter("open-elevation")):
         # Handle the elevation data and replace 'null' with 0
         for result in data['results']:
             elevation = result.get('elevation', None)
             if elevation is None:
                 elevation = 0
             elevations.append(elevation)
-        
-        # Get current time for request rate limiting
-        now = time.monotonic()  
-        elapsed_time = now - last_request_time
-        if elapsed_time < 2:
-            time.sleep(2 - elapsed_time)  # Pause to prevent request throttling
 
     return elevations
 
-def lonlat_to_tilexy(lon, lat, zoom):
-    lat_rad = math.radians(lat)
+def lonlat_to_global_pixel(lon, lat, zoom):
+    """Vectorized Web Mercator position in pixels of the whole zoom level (256 px per tile, pixel edges at integers)."""
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
     n = 2.0 ** zoom
-    xtile = int((lon + 180.0) / 360.0 * n)
-    ytile = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
-    return xtile, ytile
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n * 256
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * n * 256
+    return x, y
+
+class TileLRU:
+    """Decoded tile elevation grids keyed by (zoom, x, y), least recently used first out once the byte budget is exceeded."""
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.size = 0
+        self.source_key = None #tile source the entries were read from
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            grid = self.tiles.get(key)
+            if grid is not None:
+                self.tiles.move_to_end(key)
+            return grid
+
+    def put(self, key, grid):
+        #a private in-memory copy, so memory-mapped cache files can still be evicted or replaced
+        grid = np.array(grid, dtype=np.float32)
+        with self.lock:
+            old = self.tiles.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            self.tiles[key] = grid
+            self.size += grid.nbytes
+            self._evict()
+        return grid
+
+    def resize(self, budget_bytes):
+        with self.lock:
+            self.budget = budget_bytes
+            self._evict()
+
+    def use_source(self, source_key):
+        """Drop every entry when the tiles come from a different source than before."""
+        with self.lock:
+            if source_key != self.source_key:
+                self.tiles.clear()
+                self.size = 0
+                self.source_key = source_key
+
+    def _evict(self):
+        while self.size > self.budget and self.tiles:
+            _, grid = self.tiles.popitem(last=False)
+            self.size -= grid.nbytes
+
+def tile_memory_budget():
+    return bpy.context.scene.tp3d.get("tileMemoryBudget", 256) * 2**20
+
+def get_tile_lru():
+    """The session-wide decoded tile LRU, resized to what the memory budget leaves next to the kept tile raster."""
+    global _tile_lru
+    budget = tile_memory_budget()
+    if _terrarium_mosaic is not None:
+        budget = max(budget - _terrarium_mosaic.data.nbytes, 0)
+    if _tile_lru is None:
+        _tile_lru = TileLRU(budget)
+    elif _tile_lru.budget != budget:
+        _tile_lru.resize(budget)
+    return _tile_lru
+
+def gather_tile_pixels(gx, gy, zoom, load_tile):
+    """
+    Read the pixels at integer global positions gx, gy. Positions are grouped by tile with one argsort,
+    so every tile is read with a single fancy-index gather. load_tile(xtile, ytile) returns the grid or None;
+    pixels of missing tiles are NaN. Columns wrap around the antimeridian, rows are clamped at the poles.
+    """
+    size = int(2 ** zoom) * 256
+    gx = np.mod(gx, size)
+    gy = np.clip(gy, 0, size - 1)
+    tile_ids = (gx // 256) * (size // 256) + gy // 256
+    order = np.argsort(tile_ids, kind="stable")
+    sorted_ids = tile_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+
+    values = np.full(len(gx), np.nan, dtype=np.float32)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        idx = order[start:end]
+        tile_id = int(sorted_ids[start])
+        grid = load_tile(tile_id // (size // 256), tile_id % (size // 256))
+        if grid is not None:
+            values[idx] = grid[gy[idx] % 256, gx[idx] % 256]
+    return values
+
+def sample_terrarium(lats, lons, zoom, load_tile, bilinear=False):
+    """
+    Elevation at every lat/lon, either from the nearest pixel or bilinearly interpolated between the four
+    surrounding pixel centres. Neighbours are read from the adjacent tile where a point sits on a tile seam.
+    Missing pixels are left out of the weighting; points without any data get 0.
+    """
+    x, y = lonlat_to_global_pixel(lons, lats, zoom)
+    if not bilinear:
+        values = gather_tile_pixels(np.floor(x).astype(np.int64), np.floor(y).astype(np.int64), zoom, load_tile)
+        return np.nan_to_num(values, nan=0.0)
+
+    #pixel centres sit at .5
+    x -= 0.5
+    y -= 0.5
+    x0 = np.floor(x).astype(np.int64)
+    y0 = np.floor(y).astype(np.int64)
+    fx = x - x0
+    fy = y - y0
+    total = np.zeros(len(x))
+    weight = np.zeros(len(x))
+    for dx, dy, w in ((0, 0, (1 - fx) * (1 - fy)), (1, 0, fx * (1 - fy)), (0, 1, (1 - fx) * fy), (1, 1, fx * fy)):
+        values = gather_tile_pixels(x0 + dx, y0 + dy, zoom, load_tile)
+        valid = ~np.isnan(values)
+        total += np.where(valid, values, 0) * w
+        weight += valid * w
+    return np.divide(total, weight, out=np.zeros_like(total), where=weight > 0)
+
+class TerrariumMosaic:
+    """
+    Terrarium tiles stitched into one contiguous float32 raster (NaN where a tile is missing), with the
+    global pixel position (x0, y0) of its top-left corner. Kept between generations so a map over the same
+    tiles is sampled again without reading any tile.
+    """
 
-def lonlat_to_pixelxy(lon, lat, zoom):
-    lat_rad = math.radians(lat)
-    n = 2.0 ** zoom
-    x = (lon + 180.0) / 360.0 * n * 256
-    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n * 256
-    return int(x % 256), int(y % 256)
+    def __init__(self, data, zoom, x0, y0, key=None, complete=True):
+        self.data = data
+        self.zoom = zoom
+        self.x0 = x0
+        self.y0 = y0
+        self.key = key #tile source the raster was read from
+        self.complete = complete #False if any tile could not be read
+
+    @classmethod
+    def assemble(cls, zoom, tiles, load_tile, key=None):
+        """Read every (xtile, ytile) in tiles into one raster covering their bounding box. load_tile returns None for missing tiles."""
+        xs = np.array([x for x, _ in tiles])
+        ys = np.array([y for _, y in tiles])
+        tx0, ty0 = int(xs.min()), int(ys.min())
+        data = np.full(((int(ys.max()) - ty0 + 1) * 256, (int(xs.max()) - tx0 + 1) * 256), np.nan, dtype=np.float32)
+        tiles_per_axis = int(2 ** zoom)
+        complete = True
+        progress_intervals = set(range(10,101,10))
+        for i, (xtile, ytile) in enumerate(tiles, 1):
+            grid = load_tile(xtile % tiles_per_axis, ytile)
+            if grid is None:
+                complete = False
+            else:
+                row, col = (ytile - ty0) * 256, (xtile - tx0) * 256
+                data[row:row + 256, col:col + 256] = grid
+            percent_complete = int((i / len(tiles)) * 100)
+            if percent_complete in progress_intervals:
+                print(f"{datetime.now().strftime('%H:%M:%S')} - {percent_complete}% complete, {i}")
+                progress_intervals.remove(percent_complete)
+        return cls(data, zoom, tx0 * 256, ty0 * 256, key, complete)
+
+    def covers_tiles(self, zoom, tiles, key=None):
+        rows, cols = self.data.shape
+        return self.complete and zoom == self.zoom and key == self.key and all(
+            self.x0 <= x * 256 < self.x0 + cols and self.y0 <= y * 256 < self.y0 + rows for x, y in tiles)
+
+    def tile(self, xtile, ytile):
+        """The 256x256 block of a tile (also across the antimeridian), None if it lies outside the raster."""
+        rows, cols = self.data.shape
+        row = ytile * 256 - self.y0
+        if not 0 <= row < rows:
+            return None
+        tiles_per_axis = int(2 ** self.zoom)
+        for x in (xtile, xtile - tiles_per_axis, xtile + tiles_per_axis):
+            col = x * 256 - self.x0
+            if 0 <= col < cols:
+                return self.data[row:row + 256, col:col + 256]
+        return None
+
+    def sample(self, lats, lons, bilinear=False):
+        """Elevation at every lat/lon, read from the stitched raster with sample_terrarium."""
+        return sample_terrarium(lats, lons, self.zoom, self.tile, bilinear)
+
+def get_http_session(pool_size=8):
+    """Return the shared requests.Session, (re)creating it when the connection pool is too small."""
+    global _http_session, _http_pool_size
+    with _http_session_lock:
+        if _http_session is None or _http_pool_size < pool_size:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=2)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+            _http_pool_size = pool_size
+        return _http_session
+
+def terrarium_tile_path(zoom, xtile, ytile):
+    """Path of the cached PNG for a tile."""
+    return os.path.join(terrarium_cache_dir, str(zoom), str(xtile), f"{ytile}.png")
+
+def terrarium_decoded_path(zoom, xtile, ytile):
+    """Path of the cached float32 elevation grid (decoded PNG) for a tile."""
+    return os.path.join(terrarium_cache_dir, str(zoom), str(xtile), f"{ytile}.npy")
+
+def migrate_flat_tile_cache():
+    """Move tiles of the old flat layout ({zoom}_{x}_{y}.png/.npy in the cache root) into the zoom/x folders."""
+    moved = 0
+    with os.scandir(terrarium_cache_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stem, ext = os.path.splitext(entry.name)
+            parts = stem.split("_")
+            if ext not in (".png", ".npy") or len(parts) != 3 or not all(p.isdigit() for p in parts):
+                continue
+            target = os.path.join(terrarium_cache_dir, parts[0], parts[1], parts[2] + ext)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            moved += 1
+    if moved:
+        print(f"Moved {moved} cached tiles into the zoom/x folder layout")
+
+def tile_cache_index():
+    """
+    The {path: [size, last access]} index of the tile cache. Built once per session from a scan of the
+    cache folder (after migrating the old flat layout) and kept up to date as tiles are written and read.
+    Call with _tile_index_lock held.
+    """
+    global _tile_index, _tile_index_bytes
+    if _tile_index is None:
+        index = {}
+        if os.path.isdir(terrarium_cache_dir):
+            migrate_flat_tile_cache()
+            for folder, _, files in os.walk(terrarium_cache_dir):
+                for filename in files:
+                    if filename.endswith((".png", ".npy")):
+                        path = os.path.join(folder, filename)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        index[path] = [stat.st_size, max(stat.st_atime, stat.st_mtime)]
+        _tile_index = index
+        _tile_index_bytes = sum(size for size, _ in index.values())
+    return _tile_index
+
+def record_tile_cache_file(path):
+    """Add a newly written cache file to the index."""
+    global _tile_index_bytes
+    with _tile_index_lock:
+        index = tile_cache_index()
+        size = os.path.getsize(path)
+        old = index.get(path)
+        _tile_index_bytes += size - (old[0] if old else 0)
+        index[path] = [size, time.time()]
+
+def touch_tile_cache_file(path):
+    """Mark a cache file as used. The access time is also written to disk so the LRU order survives restarts."""
+    now = time.time()
+    with _tile_index_lock:
+        entry = tile_cache_index().get(path)
+        if entry is not None:
+            entry[1] = now
+    try:
+        os.utime(path, (now, os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+def tile_cache_info():
+    """(number of files, total bytes, time of the least recently used file or None)."""
+    with _tile_index_lock:
+        index = tile_cache_index()
+        oldest = min((atime for _, atime in index.values()), default=None)
+        return len(index), _tile_index_bytes, oldest
+
+def trim_tile_cache(quota_bytes, target=0.9):
+    """
+    Delete least recently used cache files until the cache is below target * quota_bytes.
+    Does nothing while the cache is within the quota. Returns (files removed, bytes freed).
+    """
+    global _tile_index_bytes
+    removed = 0
+    freed = 0
+    with _tile_index_lock:
+        index = tile_cache_index()
+        if _tile_index_bytes <= quota_bytes:
+            return removed, freed
+        limit = quota_bytes * target
+        for path, (size, _) in sorted(index.items(), key=lambda item: item[1][1]):
+            if _tile_index_bytes <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                #e.g. a tile that is still memory-mapped on Windows
+                print(f"Could not remove cached tile {path}: {e}")
+                continue
+            try:
+                os.rmdir(os.path.dirname(path)) #only succeeds once the x folder is empty
+            except OSError:
+                pass
+            del index[path]
+            _tile_index_bytes -= size
+            removed += 1
+            freed += size
+    if removed:
+        print(f"Tile cache: removed {removed} least recently used files ({freed / 2**20:.1f} MB)")
+    return removed, freed
+
+def tile_cache_quota():
+    return bpy.context.scene.tp3d.get("tileCacheQuota", 2048) * 2**20
+
+def download_terrarium_tile(zoom, xtile, ytile, session=None):
+    """Download a tile into the cache. Writes to a temp file first so parallel readers never see partial PNGs."""
+    if session is None:
+        session = get_http_session()
+    url = f"https://elevation-tiles-prod.s3.amazonaws.com/terrarium/{zoom}/{xtile}/{ytile}.png"
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    tile_path = terrarium_tile_path(zoom, xtile, ytile)
+    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+    tmp_path = f"{tile_path}.{threading.get_ident()}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(response.content)
+    os.replace(tmp_path, tile_path)
+    record_tile_cache_file(tile_path)
 
 def fetch_terrarium_tile_raw(zoom, xtile, ytile):
     """Fetch the raw PNG binary data for a tile, either from cache or online."""
-    tile_path = os.path.join(terrarium_cache_dir, f"{zoom}_{xtile}_{ytile}.png")
+    tile_path = terrarium_tile_path(zoom, xtile, ytile)
     if not os.path.exists(tile_path):
-        url = f"https://elevation-tiles-prod.s3.amazonaws.com/terrarium/{zoom}/{xtile}/{ytile}.png"
-        #print("Sending Request")
-        response = requests.get(url)
-        response.raise_for_status()
-        with open(tile_path, "wb") as f:
-            f.write(response.content)
+        download_terrarium_tile(zoom, xtile, ytile)
+    else:
+        touch_tile_cache_file(tile_path)
     with open(tile_path, "rb") as f:
         return f.read()
 
-def paeth_predictor(a, b, c):
-    # PNG Paeth filter
-    p = a + b - c
-    pa = abs(p - a)
-    pb = abs(p - b)
-    pc = abs(p - c)
-    if pa <= pb and pa <= pc:
-        return a
-    elif pb <= pc:
-        return b
-    else:
-        return c
+def cached_tile_keys():
+    """Set of (zoom, xtile, ytile) with a PNG or decoded copy in the cache, taken from the cache index."""
+    keys = set()
+    with _tile_index_lock:
+        for path in tile_cache_index():
+            parts = os.path.relpath(path, terrarium_cache_dir).split(os.sep)
+            if len(parts) == 3:
+                stem = os.path.splitext(parts[2])[0]
+                if parts[0].isdigit() and parts[1].isdigit() and stem.isdigit():
+                    keys.add((int(parts[0]), int(parts[1]), int(stem)))
+    return keys
+
+def derive_terrarium_tile(zoom, xtile, ytile, cached, depth=TERRARIUM_DERIVE_DEPTH):
+    """
+    Build a missing tile from cached tiles of the next zoom levels (up to `depth` levels down) by 2x2
+    averaging, and store it in the cache as a decoded tile. cached is the set from cached_tile_keys().
+    Returns the grid, or None if the descendants do not cover the whole tile or one of them cannot be read.
+    """
+    if depth <= 0 or zoom >= TERRARIUM_MAX_ZOOM:
+        return None
+    children = []
+    for dy in (0, 1):
+        for dx in (0, 1):
+            cx, cy = 2 * xtile + dx, 2 * ytile + dy
+            if (zoom + 1, cx, cy) in cached:
+                try:
+                    child = load_terrarium_elevation_tile(zoom + 1, cx, cy)
+                except Exception as e:
+                    print(f"Cached tile {zoom + 1}/{cx}/{cy} is unreadable, downloading {zoom}/{xtile}/{ytile} instead: {e}")
+                    return None
+            else:
+                child = derive_terrarium_tile(zoom + 1, cx, cy, cached, depth - 1)
+            if child is None:
+                return None
+            children.append(np.asarray(child, dtype=np.float32))
+    stitched = np.block([[children[0], children[1]], [children[2], children[3]]])
+    elevation_grid = stitched.reshape(256, 2, 256, 2).mean(axis=(1, 3), dtype=np.float32)
+    try:
+        save_decoded_terrarium_tile(zoom, xtile, ytile, elevation_grid)
+    except OSError as e:
+        print(f"Could not cache derived tile {zoom}/{xtile}/{ytile}: {e}")
+    cached.add((zoom, xtile, ytile))
+    return elevation_grid
+
+def prefetch_terrarium_tiles(zoom, tiles, workers=8):
+    """
+    Download all tiles that are not in the cache yet, with at most `workers` requests in flight.
+    Tiles whose area is already cached at a finer zoom are built from those tiles instead of being downloaded.
+    Returns a dict {(xtile, ytile): exception} for the tiles that could not be fetched.
+    """
+    cached = cached_tile_keys() #also moves tiles of the old flat layout into place before the first lookup
+    missing = [(x, y) for x, y in tiles if (zoom, x, y) not in cached]
+    failed = {}
+    if not missing:
+        return failed
+
+    derived = {(x, y) for x, y in missing if derive_terrarium_tile(zoom, x, y, cached) is not None}
+    if derived:
+        print(f"Built {len(derived)} tiles at zoom {zoom} from cached zoom {zoom + 1}+ tiles")
+        missing = [tile for tile in missing if tile not in derived]
+    if not missing:
+        return failed
+
+    print(f"Downloading {len(missing)} tiles ({len(tiles) - len(missing)} cached) with {workers} workers")
+    session = get_http_session(workers)
+    progress_intervals = set(range(10, 101, 10))
+    with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+        futures = {pool.submit(download_terrarium_tile, zoom, x, y, session): (x, y) for x, y in missing}
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                xtile, ytile = futures[future]
+                failed[(xtile, ytile)] = e
+                print(f"Failed to fetch tile {zoom}/{xtile}/{ytile}: {e}")
+            percent_complete = int((i / len(missing)) * 100)
+            if percent_complete in progress_intervals:
+                print(f"{datetime.now().strftime('%H:%M:%S')} - download {percent_complete}% complete, {i}")
+                progress_intervals.remove(percent_complete)
+    return failed
+
+def _png_unfilter_rows(filters, data, bpp):
+    """Undo PNG filters 0-2 (None/Sub/Up). Every row is reconstructed with one array operation."""
+    recon = np.empty_like(data)
+    prev_row = np.zeros(data.shape[1], dtype=np.uint8)
+    for y, filter_type in enumerate(filters.tolist()):
+        scanline = data[y]
+        if filter_type == 0:
+            recon[y] = scanline
+        elif filter_type == 1:  # Sub: running sum per channel, uint8 wraps modulo 256
+            recon[y] = scanline.reshape(-1, bpp).cumsum(axis=0, dtype=np.uint8).reshape(-1)
+        else:  # Up
+            recon[y] = scanline + prev_row
+        prev_row = recon[y]
+    return recon
+
+def _png_unfilter_wavefront(filters, data, bpp):
+    """
+    Undo any mix of PNG filters 0-4.
+    Average and Paeth depend on the reconstructed left pixel, so a row cannot be done in one step.
+    Pixel (y, x) only needs (y, x-1), (y-1, x) and (y-1, x-1), so a whole anti-diagonal can be
+    reconstructed at once. The image is stored skewed (row k holds the diagonal x + y == k),
+    which turns every neighbour lookup into a contiguous slice.
+    """
+    height, stride = data.shape
+    width = stride // bpp
+    ys, xs = np.indices((height, width))
+    # skewed[x + y + 1, y + 1]; the zero border stands in for the missing up/left neighbours
+    pixels = np.zeros((height + width + 1, height + 1, bpp), dtype=np.int16)
+    pixels[xs + ys + 1, ys + 1] = data.reshape(height, width, bpp)
+    recon = np.zeros_like(pixels)
+    row_filters = filters.astype(np.intp)[:, None]
+
+    for k in range(height + width - 1):
+        y0 = max(0, k - width + 1)
+        y1 = min(height, k + 1)
+        a = recon[k, y0 + 1:y1 + 1]  # left
+        b = recon[k, y0:y1]          # up
+        c = recon[k - 1, y0:y1]      # up-left
+        p = a + b - c
+        pa = np.abs(p - a)
+        pb = np.abs(p - b)
+        pc = np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        predictor = np.choose(row_filters[y0:y1], (0, a, b, (a + b) >> 1, paeth))
+        recon[k + 1, y0 + 1:y1 + 1] = (pixels[k + 1, y0 + 1:y1 + 1] + predictor) & 255
+
+    return recon[xs + ys + 1, ys + 1].astype(np.uint8).reshape(height, stride)
 
 def parse_png_rgb_data(png_bytes):
-    """Extract uncompressed RGB bytes from a PNG image (supports all PNG filter types)."""
+    """Decode an 8-bit RGB PNG (all filter types) into a uint8 array of shape (height, width, 3)."""
     assert png_bytes[:8] == b'\x89PNG\r\n\x1a\n', "Not a valid PNG file"
     offset = 8
     width = height = None
-    idat_data = b''
+    idat_chunks = []
 
     while offset < len(png_bytes):
         length = struct.unpack(">I", png_bytes[offset:offset+4])[0]
@@ -2706,59 +3949,139 @@ def parse_png_rgb_data(png_bytes):
         offset += 12 + length
 
         if chunk_type == b'IHDR':
-            width, height, bit_depth, color_type, _, _, _ = struct.unpack(">IIBBBBB", data)
-            assert bit_depth == 8 and color_type == 2, "Only 8-bit RGB PNGs supported"
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+            assert bit_depth == 8 and color_type in (2, 6), "Only 8-bit RGB PNGs supported"
+            assert interlace == 0, "Interlaced PNGs are not supported"
+            bpp = 3 if color_type == 2 else 4
         elif chunk_type == b'IDAT':
-            idat_data += data
+            idat_chunks.append(data)
         elif chunk_type == b'IEND':
             break
 
-    raw = zlib.decompress(idat_data)
-    stride = 3 * width
-    rgb_array = []
-    prev_row = bytearray(stride)
+    raw = np.frombuffer(zlib.decompress(b''.join(idat_chunks)), dtype=np.uint8)
+    stride = bpp * width
+    rows = raw[:height * (stride + 1)].reshape(height, stride + 1)
+    filters = rows[:, 0]
+    data = rows[:, 1:]
 
-    for y in range(height):
-        i = y * (stride + 1)
-        filter_type = raw[i]
-        scanline = bytearray(raw[i + 1:i + 1 + stride])
-        recon = bytearray(stride)
+    if filters.max() > 4:
+        raise ValueError(f"Unsupported filter type {int(filters.max())}")
+    if filters.max() <= 2:
+        recon = _png_unfilter_rows(filters, data, bpp)
+    else:
+        recon = _png_unfilter_wavefront(filters, data, bpp)
 
-        if filter_type == 0:
-            recon[:] = scanline
-        elif filter_type == 1:  # Sub
-            for i in range(stride):
-                val = scanline[i]
-                left = recon[i - 3] if i >= 3 else 0
-                recon[i] = (val + left) % 256
-        elif filter_type == 2:  # Up
-            for i in range(stride):
-                recon[i] = (scanline[i] + prev_row[i]) % 256
-        elif filter_type == 3:  # Average
-            for i in range(stride):
-                left = recon[i - 3] if i >= 3 else 0
-                up = prev_row[i]
-                recon[i] = (scanline[i] + (left + up) // 2) % 256
-        elif filter_type == 4:  # Paeth
-            for i in range(stride):
-                a = recon[i - 3] if i >= 3 else 0
-                b = prev_row[i]
-                c = prev_row[i - 3] if i >= 3 else 0
-                recon[i] = (scanline[i] + paeth_predictor(a, b, c)) % 256
-        else:
-            raise ValueError(f"Unsupported filter type {filter_type}")
+    return recon.reshape(height, width, bpp)[:, :, :3]
+
+
+def terrarium_pixel_to_elevation(rgb):
+    """Convert Terrarium RGB pixels (uint8 array, last axis r, g, b) to a float32 elevation grid in meters."""
+    rgb = rgb.astype(np.float32)
+    return rgb[..., 0] * 256 + rgb[..., 1] + rgb[..., 2] / 256 - 32768
 
-        # Convert scanline to list of (R, G, B) tuples
-        row = [(recon[i], recon[i+1], recon[i+2]) for i in range(0, stride, 3)]
-        rgb_array.append(row)
-        prev_row = recon
+def save_decoded_terrarium_tile(zoom, xtile, ytile, elevation_grid):
+    """Store a decoded tile as .npy so later runs can memory-map it instead of decoding the PNG again."""
+    tile_path = terrarium_decoded_path(zoom, xtile, ytile)
+    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+    tmp_path = f"{tile_path}.{threading.get_ident()}.part"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(elevation_grid, dtype=np.float32))
+    os.replace(tmp_path, tile_path)
+    record_tile_cache_file(tile_path)
 
-    return rgb_array
+def load_terrarium_elevation_tile(zoom, xtile, ytile):
+    """
+    Return the float32 elevation grid of a tile.
+    A decoded tile is memory-mapped straight from the cache; the PNG is only fetched and decoded
+    (and the result stored) when no decoded copy exists yet.
+    """
+    tile_path = terrarium_decoded_path(zoom, xtile, ytile)
+    if os.path.exists(tile_path):
+        try:
+            grid = np.load(tile_path, mmap_mode='r')
+            touch_tile_cache_file(tile_path)
+            return grid
+        except (ValueError, OSError) as e:
+            print(f"Decoded tile {zoom}/{xtile}/{ytile} is unreadable, decoding again: {e}")
 
+    elevation_grid = terrarium_pixel_to_elevation(parse_png_rgb_data(fetch_terrarium_tile_raw(zoom, xtile, ytile)))
+    try:
+        save_decoded_terrarium_tile(zoom, xtile, ytile, elevation_grid)
+    except OSError as e:
+        print(f"Could not cache decoded tile {zoom}/{xtile}/{ytile}: {e}")
+    return elevation_grid
+
+class MBTilesSource:
+    """Terrarium tiles from an MBTiles file, read over one open read-only connection."""
+
+    def __init__(self, path):
+        self.key = ("MBTILES", path)
+        self.con = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def read_tiles(self, zoom, tiles):
+        """Batched lookup of (xtile, ytile) tiles. Returns {(xtile, ytile): png bytes} for the tiles present."""
+        flip = 2 ** zoom - 1 #MBTiles uses TMS rows (y grows northwards)
+        found = {}
+        chunk = 400 #stay below the SQLite host parameter limit
+        for i in range(0, len(tiles), chunk):
+            part = tiles[i:i + chunk]
+            values = ",".join(["(?,?)"] * len(part))
+            params = [zoom] + [v for x, y in part for v in (x, flip - y)]
+            rows = self.con.execute(
+                f"SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level = ? AND (tile_column, tile_row) IN (VALUES {values})",
+                params)
+            for x, tms_y, data in rows:
+                found[(x, flip - tms_y)] = bytes(data)
+        return found
+
+    def close(self):
+        self.con.close()
+
+class DirectoryTileSource:
+    """Terrarium tiles from a local z/x/y.png folder tree."""
+
+    def __init__(self, path):
+        self.key = ("DIRECTORY", path)
+        self.path = path
+
+    def read_tiles(self, zoom, tiles):
+        """Returns {(xtile, ytile): png bytes} for the tiles present in the folder."""
+        found = {}
+        for x, y in tiles:
+            tile_path = os.path.join(self.path, str(zoom), str(x), f"{y}.png")
+            if os.path.exists(tile_path):
+                with open(tile_path, "rb") as f:
+                    found[(x, y)] = f.read()
+        return found
+
+    def close(self):
+        pass
+
+def get_terrarium_source():
+    """
+    The local tile set selected in the scene settings, or None for the online source.
+    The MBTiles connection stays open until another source is selected.
+    Raises FileNotFoundError if the selected file or folder does not exist.
+    """
+    global _terrarium_source
+    props = bpy.context.scene.tp3d
+    mode = props.terrariumSource
+    if mode == "ONLINE":
+        return None
+    if mode == "MBTILES":
+        path = bpy.path.abspath(props.terrariumMbtiles)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+    else:
+        path = bpy.path.abspath(props.terrariumTileDir)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(path)
 
-def terrarium_pixel_to_elevation(r, g, b):
-    """Convert Terrarium RGB pixel to elevation in meters."""
-    return (r * 256 + g + b / 256) - 32768
+    if _terrarium_source is None or _terrarium_source.key != (mode, path):
+        if _terrarium_source is not None:
+            _terrarium_source.close()
+        _terrarium_source = MBTilesSource(path) if mode == "MBTILES" else DirectoryTileSource(path)
+    return _terrarium_source
 
 def get_elevation_TerrainTiles(coords, lenv=0, pointsDone=0, zoom=10):
 
@@ -2793,36 +4116,344 @@ def get_elevation_TerrainTiles(coords, lenv=0, pointsDone=0, zoom=10):
     
 
 
-    tile_dict = {}
-    for idx, (lat, lon) in enumerate(coords):
-        xtile, ytile = lonlat_to_tilexy(lon, lat, zoom)
-        tile_dict.setdefault((xtile, ytile), []).append((idx, lat, lon))
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    lats, lons = coords[:, 0], coords[:, 1]
+    bilinear = bpy.context.scene.tp3d.get("tileBilinear", False)
+
+    #every tile a sample can touch, including the neighbours needed for interpolation across seams
+    x, y = lonlat_to_global_pixel(lons, lats, zoom)
+    tiles_per_axis = int(2 ** zoom)
+    reach = (-0.5, 0.5) if bilinear else (0,)
+    tile_x = np.concatenate([np.floor((x + d) / 256) for d in reach]).astype(np.int64)
+    tile_y = np.clip(np.concatenate([np.floor((y + d) / 256) for d in reach]).astype(np.int64), 0, tiles_per_axis - 1)
+    #the mosaic is filled over the bounding box, so the tile list covers all of it
+    tiles = [(tx, ty) for ty in range(int(tile_y.min()), int(tile_y.max()) + 1) for tx in range(int(tile_x.min()), int(tile_x.max()) + 1)]
+    wrapped = sorted({(tx % tiles_per_axis, ty) for tx, ty in tiles})
 
-    total_tiles = len(tile_dict)
-    progress_intervals = set(range(10,101,10))
-    elevations = [0] * len(coords)
-    for i, ((xtile, ytile), idx_lat_lon_list) in enumerate(tile_dict.items(), 1):
-        percent_complete = int((i/ total_tiles) * 100)
-        if percent_complete in progress_intervals:
-            print(f"{datetime.now().strftime('%H:%M:%S')} - {percent_complete}% complete, {i}")
-            progress_intervals.remove(percent_complete)
+    try:
+        source = get_terrarium_source()
+    except FileNotFoundError as e:
+        show_message_box(f"未找到本地瓦片来源: {e}")
+        return [0] * len(coords)
+    source_key = ("ONLINE", terrarium_cache_dir) if source is None else source.key
+
+    global _terrarium_mosaic
+    budget = tile_memory_budget()
+    if _terrarium_mosaic is not None and _terrarium_mosaic.data.nbytes > budget:
+        _terrarium_mosaic = None
+    if _terrarium_mosaic is not None and _terrarium_mosaic.covers_tiles(zoom, tiles, source_key):
+        print(f"Reusing the zoom {zoom} tile raster of the previous run")
+        return _terrarium_mosaic.sample(lats, lons, bilinear).tolist()
+    #the old raster is released before the new one is read, the tile LRU gets the whole budget meanwhile
+    _terrarium_mosaic = None
+
+    #tiles decoded earlier in this session are taken from memory
+    lru = get_tile_lru()
+    lru.use_source(source_key)
+    in_memory = {tile for tile in wrapped if lru.get((zoom,) + tile) is not None}
+    wrapped = [tile for tile in wrapped if tile not in in_memory]
+    if in_memory:
+        print(f"{len(in_memory)} tiles at zoom {zoom} already in memory")
+
+    if source is None:
+        #download all missing tiles in parallel before sampling
+        workers = bpy.context.scene.tp3d.get("tileWorkers", 8)
+        failed_tiles = prefetch_terrarium_tiles(zoom, wrapped, workers)
+
+        def read_tile(xtile, ytile):
+            return load_terrarium_elevation_tile(zoom, xtile, ytile)
+    else:
+        #local tile set: read everything in one batch, decode in memory, write nothing to the cache
+        raw_tiles = source.read_tiles(zoom, wrapped)
+        failed_tiles = {tile: None for tile in wrapped if tile not in raw_tiles}
+        if failed_tiles:
+            print(f"{len(failed_tiles)} of {len(wrapped)} tiles at zoom {zoom} are missing from the local tile set")
+
+        def read_tile(xtile, ytile):
+            if (xtile, ytile) not in raw_tiles:
+                #was in memory at the start but has been evicted since
+                raw_tiles.update(source.read_tiles(zoom, [(xtile, ytile)]))
+            return terrarium_pixel_to_elevation(parse_png_rgb_data(raw_tiles[(xtile, ytile)]))
+
+    def load_tile(xtile, ytile):
+        grid = lru.get((zoom, xtile, ytile))
+        if grid is not None:
+            return grid
+        if (xtile, ytile) in failed_tiles:
+            return None
         try:
-            png_bytes = fetch_terrarium_tile_raw(zoom, xtile, ytile)
-            rgb_array = parse_png_rgb_data(png_bytes)
+            return lru.put((zoom, xtile, ytile), read_tile(xtile, ytile))
         except Exception as e:
             print(f"Failed to fetch or parse tile {zoom}/{xtile}/{ytile}: {e}")
-            for idx, _, _ in idx_lat_lon_list:
-                elevations[idx] = 0
-            continue
+            return None
+
+    #stitch all tiles into one raster and sample every vertex from it at once
+    mosaic = TerrariumMosaic.assemble(zoom, tiles, load_tile, source_key)
+    if source is None:
+        trim_tile_cache(tile_cache_quota())
+    elevations = mosaic.sample(lats, lons, bilinear).tolist()
+    #kept for the next generation only if it fits in the memory budget, which it then shares with the tile LRU
+    if mosaic.data.nbytes <= budget:
+        _terrarium_mosaic = mosaic
+        get_tile_lru()
+    return elevations
 
-        for idx, lat, lon in idx_lat_lon_list:
-            px, py = lonlat_to_pixelxy(lon, lat, zoom)
-            px = min(max(px, 0), 255)
-            py = min(max(py, 0), 255)
-            r, g, b = rgb_array[py][px]
-            elevations[idx] = terrarium_pixel_to_elevation(r, g, b)
+class DemRaster:
+    """A north-up elevation grid (memory-mapped where possible) with the lat/lon of its first pixel centre and pixel size."""
+
+    def __init__(self, data, lat0, lon0, dlat, dlon, nodata=None):
+        self.data = data
+        self.lat0 = lat0 #latitude of row 0 (north)
+        self.lon0 = lon0 #longitude of column 0 (west)
+        self.dlat = dlat
+        self.dlon = dlon
+        self.nodata = nodata
+
+    def sample(self, lat, lon):
+        """Vectorized bilinear interpolation. Void pixels are left out of the weighting."""
+        rows, cols = self.data.shape
+        r = np.clip((self.lat0 - lat) / self.dlat, 0, rows - 1)
+        c = np.clip((lon - self.lon0) / self.dlon, 0, cols - 1)
+        r0 = np.minimum(np.floor(r).astype(np.int64), max(rows - 2, 0))
+        c0 = np.minimum(np.floor(c).astype(np.int64), max(cols - 2, 0))
+        fr = r - r0
+        fc = c - c0
+        r1 = np.minimum(r0 + 1, rows - 1)
+        c1 = np.minimum(c0 + 1, cols - 1)
+
+        values = np.stack([self.data[r0, c0], self.data[r0, c1], self.data[r1, c0], self.data[r1, c1]]).astype(np.float64)
+        weights = np.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc])
+        if self.nodata is not None:
+            valid = values != self.nodata
+        else:
+            valid = np.isfinite(values)
+        weights = np.where(valid, weights, 0)
+        total = weights.sum(axis=0)
+        result = (np.where(valid, values, 0) * weights).sum(axis=0)
+        return np.where(total > 0, result / np.where(total > 0, total, 1), 0.0)
+
+def raster_bounds(lat0, lon0, dlat, dlon, rows, cols):
+    """(south, north, west, east) edges of a north-up grid given the centre of its first pixel."""
+    return (lat0 - (rows - 0.5) * dlat, lat0 + dlat / 2, lon0 - dlon / 2, lon0 + (cols - 0.5) * dlon)
+
+def bounds_cover(bounds, lat, lon):
+    south, north, west, east = bounds
+    return (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+
+def open_hgt_tile(path, lat, lon):
+    """Memory-map an SRTM .hgt tile (big-endian int16, 1201^2 or 3601^2 samples covering 1x1 degree)."""
+    samples = int(round(math.sqrt(os.path.getsize(path) // 2)))
+    data = np.memmap(path, dtype=">i2", mode="r", shape=(samples, samples))
+    step = 1.0 / (samples - 1)
+    return DemRaster(data, lat + 1, lon, step, step, nodata=-32768)
+
+def parse_hgt_name(filename):
+    """'N47E008.hgt' -> (47, 8) (south-west corner), None if the name does not match."""
+    stem = os.path.splitext(os.path.basename(filename))[0].upper()
+    if len(stem) < 7 or stem[0] not in "NS" or stem[3] not in "EW":
+        return None
+    try:
+        lat = int(stem[1:3])
+        lon = int(stem[4:7])
+    except ValueError:
+        return None
+    return (-lat if stem[0] == "S" else lat, -lon if stem[3] == "W" else lon)
 
-    return elevations
+def read_geotiff_layout(path):
+    """
+    Read the header of an uncompressed, stripped, single band GeoTIFF in geographic (WGS84) coordinates
+    without touching the pixel data. Returns a dict describing the strips and georeferencing, None if unsupported.
+    """
+    with open(path, "rb") as f:
+        header = f.read(8)
+        if header[:2] == b"II":
+            endian = "<"
+        elif header[:2] == b"MM":
+            endian = ">"
+        else:
+            return None
+        if struct.unpack(endian + "H", header[2:4])[0] != 42:
+            return None #BigTIFF is not supported
+        ifd_offset = struct.unpack(endian + "I", header[4:8])[0]
+        f.seek(ifd_offset)
+        count = struct.unpack(endian + "H", f.read(2))[0]
+        entries = f.read(count * 12)
+
+        type_formats = {1: "B", 2: "s", 3: "H", 4: "I", 11: "f", 12: "d", 16: "Q"}
+        type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 11: 4, 12: 8, 16: 8}
+        tags = {}
+        for n in range(count):
+            tag, typ, num = struct.unpack(endian + "HHI", entries[n * 12:n * 12 + 8])
+            if typ not in type_formats:
+                continue
+            size = type_sizes[typ] * num
+            raw = entries[n * 12 + 8:n * 12 + 12]
+            if size > 4:
+                f.seek(struct.unpack(endian + "I", raw)[0])
+                raw = f.read(size)
+            if typ == 2:
+                tags[tag] = raw[:size].rstrip(b"\0").decode("ascii", "ignore")
+            else:
+                tags[tag] = struct.unpack(endian + type_formats[typ] * num, raw[:size])
+
+    width, height = tags[256][0], tags[257][0]
+    bits = tags.get(258, (8,))[0]
+    sample_format = tags.get(339, (1,))[0]
+    if tags.get(259, (1,))[0] != 1 or tags.get(277, (1,))[0] != 1 or 322 in tags:
+        print(f"Skipping {path}: only uncompressed, single band, stripped GeoTIFFs are supported")
+        return None
+    geokeys = tags.get(34735, ())
+    keys = {geokeys[i]: geokeys[i + 3] for i in range(4, len(geokeys) - 3, 4)}
+    if keys.get(1024, 2) != 2:
+        print(f"Skipping {path}: GeoTIFF is not in geographic (lat/lon) coordinates")
+        return None
+
+    scale_x, scale_y = tags[33550][:2]
+    tie_i, tie_j, _, tie_x, tie_y, _ = tags[33922][:6]
+    # PixelIsArea (default): the tiepoint is the corner of the pixel, move it to the pixel centre
+    half = 0.5 if keys.get(1025, 1) == 1 else 0.0
+    lon0 = tie_x + (half - tie_i) * scale_x
+    lat0 = tie_y - (half - tie_j) * scale_y
+    return {
+        "dtype": np.dtype({1: "u", 2: "i", 3: "f"}[sample_format] + str(bits // 8)).newbyteorder(endian),
+        "width": width,
+        "height": height,
+        "offsets": tags[273],
+        "byte_counts": tags[279],
+        "rows_per_strip": tags.get(278, (height,))[0],
+        "lat0": lat0,
+        "lon0": lon0,
+        "dlat": scale_y,
+        "dlon": scale_x,
+        "nodata": float(tags[42113]) if 42113 in tags and tags[42113].strip() else None,
+        "bounds": raster_bounds(lat0, lon0, scale_y, scale_x, height, width),
+    }
+
+def open_geotiff(path, layout=None):
+    """
+    Open a GeoTIFF described by read_geotiff_layout. Contiguous strips are memory-mapped,
+    otherwise the strips are read into memory. Returns None if unsupported.
+    """
+    if layout is None:
+        layout = read_geotiff_layout(path)
+        if layout is None:
+            return None
+    dtype, width, height = layout["dtype"], layout["width"], layout["height"]
+    offsets = layout["offsets"]
+    byte_counts = layout["byte_counts"]
+    rows_per_strip = layout["rows_per_strip"]
+    contiguous = all(offsets[i] + byte_counts[i] == offsets[i + 1] for i in range(len(offsets) - 1))
+    if contiguous:
+        data = np.memmap(path, dtype=dtype, mode="r", offset=offsets[0], shape=(height, width))
+    else:
+        strips = []
+        with open(path, "rb") as f:
+            for i, offset in enumerate(offsets):
+                strip_rows = min(rows_per_strip, height - i * rows_per_strip)
+                f.seek(offset)
+                strips.append(np.frombuffer(f.read(strip_rows * width * dtype.itemsize), dtype=dtype).reshape(strip_rows, width))
+        data = np.concatenate(strips)
+    return DemRaster(data, layout["lat0"], layout["lon0"], layout["dlat"], layout["dlon"], layout["nodata"])
+
+def load_local_dem_index(folder):
+    """
+    Scan the DEM folder once (rescanned when it changes). .hgt tiles are indexed by the integer corner in
+    their file name and GeoTIFFs by the bounds in their header; no pixel data is opened here.
+    """
+    global _local_dem_index
+    mtime = os.path.getmtime(folder)
+    if _local_dem_index is not None and _local_dem_index[0] == folder and _local_dem_index[1] == mtime:
+        return _local_dem_index[2], _local_dem_index[3]
+
+    hgt_tiles = {}
+    geotiffs = []
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            path = os.path.join(root, filename)
+            ext = os.path.splitext(filename)[1].lower()
+            try:
+                if ext == ".hgt":
+                    corner = parse_hgt_name(filename)
+                    if corner is not None:
+                        hgt_tiles[corner] = path
+                elif ext in (".tif", ".tiff"):
+                    layout = read_geotiff_layout(path)
+                    if layout is not None:
+                        geotiffs.append((path, layout))
+            except Exception as e:
+                print(f"Could not read DEM file {path}: {e}")
+    print(f"Local DEM: {len(hgt_tiles)} .hgt tiles, {len(geotiffs)} GeoTIFFs in {folder}")
+    _local_dem_index = (folder, mtime, hgt_tiles, geotiffs)
+    return hgt_tiles, geotiffs
+
+def get_elevation_LocalDEM(coords, lenv=0, pointsDone=0):
+    """
+    Samples elevations from local SRTM .hgt / GeoTIFF files with bilinear interpolation.
+    Only the files covering the requested points are memory-mapped, and only for the duration of this call.
+    """
+    folder = bpy.path.abspath(bpy.context.scene.tp3d.get("localDemPath", ""))
+    if not folder or not os.path.isdir(folder):
+        show_message_box("未找到本地DEM文件夹。请在API设置中选择包含 .hgt 或 GeoTIFF 文件的文件夹")
+        return [0.0] * len(coords)
+    hgt_tiles, geotiffs = load_local_dem_index(folder)
+
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    lat = coords[:, 0]
+    lon = coords[:, 1]
+    elevations = np.zeros(len(coords))
+    done = np.zeros(len(coords), dtype=bool)
+
+    # .hgt tiles are found directly from the integer degree of each point
+    if hgt_tiles:
+        def has_tile(keys):
+            unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            return np.array([tuple(key) in hgt_tiles for key in unique_keys.tolist()], dtype=bool)[inverse.ravel()]
+
+        floor_keys = np.column_stack((np.floor(lat), np.floor(lon))).astype(np.int64)
+        keys = floor_keys.copy()
+        found = has_tile(keys)
+        #a point on a whole degree is also on the north/east edge of the tile below/left of it
+        on_lat = lat == np.floor(lat)
+        on_lon = lon == np.floor(lon)
+        for shift, edge in (((1, 0), on_lat), ((0, 1), on_lon), ((1, 1), on_lat & on_lon)):
+            if not (edge & ~found).any():
+                continue
+            shifted = floor_keys - shift
+            use = edge & ~found & has_tile(shifted)
+            keys[use] = shifted[use]
+            found |= use
+
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for k, key in enumerate(unique_keys.tolist()):
+            path = hgt_tiles.get(tuple(key))
+            if path is None:
+                continue
+            try:
+                tile = open_hgt_tile(path, *key)
+            except Exception as e:
+                print(f"Could not open DEM file {path}: {e}")
+                continue
+            idx = np.flatnonzero(inverse == k)
+            elevations[idx] = tile.sample(lat[idx], lon[idx])
+            done[idx] = True
+
+    for path, layout in geotiffs:
+        idx = np.flatnonzero(~done & bounds_cover(layout["bounds"], lat, lon))
+        if not len(idx):
+            continue
+        try:
+            raster = open_geotiff(path, layout)
+        except Exception as e:
+            print(f"Could not open DEM file {path}: {e}")
+            continue
+        elevations[idx] = raster.sample(lat[idx], lon[idx])
+        done[idx] = True
+
+    missing = np.count_nonzero(~done)
+    if missing:
+        print(f"Local DEM: {missing} of {len(coords)} points are not covered by any file, using 0")
+    return elevations.tolist()
 
 def get_elevation_path_openElevation(vertices):
     """Fetches real elevation for each vertex using OpenTopoData with request batching."""
@@ -2830,32 +4461,9 @@ def get_elevation_path_openElevation(vertices):
     coords = [(v[0], v[1], v[2], v[3]) for v in vertices]
     elevations = []
     batch_size = 1000
-    for i in range(0, len(coords), batch_size):
-        batch = coords[i:i + batch_size]
-        # Open-Elevation expects a POST request with JSON body
-        payload = {"locations": [{"latitude": c[0], "longitude": c[1]} for c in batch]}
-        url = "https://api.open-elevation.com/api/v1/lookup"
-        last_request_time = time.monotonic()
-        
-        headers = {'Content-Type': 'application/json'}
-
-        addition = f"(overwrite path) {i + len(batch)}/{len(coords)}"
-        send_api_request(addition)
-
-        response = requests.post(url, json=payload, headers=headers)
-        
-        #print(url)
-        #print(payload)
-        
-        response.raise_for_status()
-
-        data = response.json()
-        
+    batches = numbered_batches(coords, batch_size, lambda n: f"(overwrite path) {n}/{len(coords)}")
+    for _, data in pipelined_requests(batches, logged(fetch_openElevation_batch), get_rate_limiter("open-elevation")):
         elevations.extend([r['elevation'] for r in data['results']])
-        now = time.monotonic()  # Monotonic time is safer for measuring elapsed time
-        elapsed_time = now - last_request_time
-        if i + batch_size < len(coords) and elapsed_time < 1.4:
-            time.sleep(1.4 - elapsed_time)  # Pause to prevent request throttling
     
     for i in range(len(vertices)):
         coords[i] =  (coords[i][0], coords[i][1], elevations[i], coords[i][3])
@@ -2870,22 +4478,10 @@ def get_elevation_path_openTopoData(vertices):
     coords = [(v[0], v[1], v[2], v[3]) for v in vertices]
     elevations = []
     batch_size = 100
-    for i in range(0, len(coords), batch_size):
-        batch = coords[i:i + batch_size]
-        query = "|".join([f"{c[0]},{c[1]}" for c in batch])
-        url = f"{opentopoAdress}{dataset}?locations={query}"
-        last_request_time = time.monotonic()
-        response = requests.get(url).json()
-        addition = f"(overwrite path) {i + len(batch)}/{len(coords)}"
-        send_api_request(addition)
-        
+    batches = numbered_batches(coords, batch_size, lambda n: f"(overwrite path) {n}/{len(coords)}")
+    for _, data in pipelined_requests(batches, logged(fetch_openTopoData_batch), get_rate_limiter("opentopodata")):
         #elevations.extend([r['elevation'] for r in response['results']])
-        elevations.extend([r.get('elevation') or 0 for r in response['results']])
-
-        now = time.monotonic()  # Monotonic time is safer for measuring elapsed time
-        elapsed_time = now - last_request_time
-        if i + batch_size < len(coords) and elapsed_time < 1.4:
-            time.sleep(1.4 - elapsed_time)  # Pause to prevent request throttling
+        elevations.extend([r.get('elevation') or 0 for r in data['results']])
     
     for i in range(len(vertices)):
         coords[i] =  (coords[i][0], coords[i][1], elevations[i], coords[i][3])
@@ -2966,6 +4562,25 @@ def RaycastCurveToMesh(curve_obj, mesh_obj):
     bpy.ops.object.mode_set(mode='OBJECT')
                     
 
+def get_world_vertex_coords(obj):
+    """Read all vertex positions of a mesh object in one call and return them in world space as an (N, 3) array."""
+    mesh = obj.data
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    co = co.reshape(-1, 3).astype(np.float64)
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    return co @ matrix[:3, :3].T + matrix[:3, 3]
+
+def set_vertex_heights(mesh, zs):
+    """Write the z coordinate of every vertex in one call. Returns the z values as stored (float32)."""
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    co = co.reshape(-1, 3)
+    co[:, 2] = zs
+    mesh.vertices.foreach_set('co', co.ravel())
+    mesh.update()
+    return co[:, 2]
+
 # Get tile elevation
 def get_tile_elevation(obj):
 
@@ -2977,22 +4592,24 @@ def get_tile_elevation(obj):
     # Set chunk size based on API
     if api == 0 or api == 1:
         chunk_size = 100000
-    elif api == 2:
+    elif api == 2 or api == 3:
         chunk_size = 50000000
     else:
         chunk_size = 100000  # fallback
 
-    vertices = list(mesh.vertices)
     obj_matrix = obj.matrix_world
+    vertex_count = len(mesh.vertices)
 
     # Convert all vertex positions to world space
-    world_verts = [obj_matrix @ v.co for v in vertices]
+    world_verts = get_world_vertex_coords(obj)
+    world_x = world_verts[:, 0]
+    world_y = world_verts[:, 1]
 
     # Get min/max bounds in world space
-    min_x = min(v.x for v in world_verts)
-    max_x = max(v.x for v in world_verts)
-    min_y = min(v.y for v in world_verts)
-    max_y = max(v.y for v in world_verts)
+    min_x = world_x.min()
+    max_x = world_x.max()
+    min_y = world_y.min()
+    max_y = world_y.max()
 
     global minLon, maxLon, minLat, maxLat
 
@@ -3000,6 +4617,9 @@ def get_tile_elevation(obj):
     origin_lat = obj_matrix.translation.y
     origin_lon = obj_matrix.translation.x
 
+    projection = ProjectionContext.from_scene()
+    lats, lons = projection.to_geo(world_x, world_y)
+
     minl = convert_to_geo(min_x, min_y)
     maxl = convert_to_geo(max_x, max_y)
 
@@ -3015,19 +4635,19 @@ def get_tile_elevation(obj):
 
     elevations = []
     for i in range(0, len(world_verts), chunk_size):
-        chunk = world_verts[i:i + chunk_size]
-
-        coords = [convert_to_geo(v.x, v.y) for v in chunk]
+        coords = np.column_stack((lats[i:i + chunk_size], lons[i:i + chunk_size])).tolist()
 
         if api == 0:
-            chunk_elevations = get_elevation_openTopoData(coords, len(vertices), i)
+            chunk_elevations = get_elevation_openTopoData(coords, vertex_count, i)
         elif api == 1:
-            chunk_elevations = get_elevation_openElevation(coords, len(vertices), i)
+            chunk_elevations = get_elevation_openElevation(coords, vertex_count, i)
         elif api == 2:
-            #print(f"Loading {i}/{len(vertices)}")
-            chunk_elevations = get_elevation_TerrainTiles(coords, len(vertices), i)
+            #print(f"Loading {i}/{vertex_count}")
+            chunk_elevations = get_elevation_TerrainTiles(coords, vertex_count, i)
+        elif api == 3:
+            chunk_elevations = get_elevation_LocalDEM(coords, vertex_count, i)
         else:
-            chunk_elevations = [0.0] * len(chunk)  # fallback
+            chunk_elevations = [0.0] * len(coords)  # fallback
 
         elevations.extend(chunk_elevations)
 
@@ -3044,7 +4664,7 @@ def get_tile_elevation(obj):
     additionalExtrusion = lowestZ
     diff = highestZ - lowestZ
 
-    bpy.context.scene.tp3d["o_verticesMap"] = str(len(mesh.vertices))
+    bpy.context.scene.tp3d["o_verticesMap"] = str(vertex_count)
 
     return elevations, diff
 
@@ -3068,41 +4688,90 @@ def haversine(lat1, lon1, lat2, lon2):
     return distance
     
     
-def calculate_total_length(points):
-    #Calculates the total path length in kilometers.
-    total_distance = 0.0
-    for i in range(1, len(points)):
-        lon1, lat1, _, _ = points[i - 1]
-        lon2, lat2, _, _ = points[i]
-        total_distance += haversine(lon1, lat1, lon2, lat2)
-    return total_distance
-
-def calculate_total_elevation(points):
-    #Calculates the total elevation gain in meters.
-    total_elevation = 0.0
-    for i in range(1, len(points)):
-        _, _, elev1, _ = points[i - 1]
-        _, _, elev2, _ = points[i]
-        if elev2 > elev1:
-            total_elevation += elev2 - elev1
-    return total_elevation
-
-def calculate_total_time(points):
-    hrs = 0
-    #Calculates the total time taken between the first and last points.
-    if len(points) < 2:
-        return 0.0
-    start_time = points[0][3]
-    end_time = points[-1][3]
-    if start_time != None and end_time != None:
-        time_diff = end_time - start_time
-        hours = int(time_diff.total_seconds() / 3600)
-        minutes = int((time_diff.total_seconds() / 3600 - hours) * 60)
-        time_str = f"{hours}h {minutes}m"
-        #print(time_str)
-        hrs = time_diff.total_seconds() / 3600
-    
-    return hrs
+def haversine_array(lat1, lon1, lat2, lon2):
+    """Vectorized haversine distance in kilometers."""
+    R = 6371.0  # Earth radius in kilometers
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2)**2
+    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def _hysteresis_climb(ele, segment_id, threshold):
+    """
+    Gain and loss per segment, counting a change only once it exceeds threshold from the last counted level.
+    Without a threshold every step counts, which is a single vectorized pass; otherwise every sample is walked.
+    """
+    n_segments = int(segment_id[-1]) + 1 if len(segment_id) else 0
+    gain = np.zeros(n_segments)
+    loss = np.zeros(n_segments)
+    if threshold <= 0:
+        if len(ele) > 1:
+            step = np.diff(ele) * (segment_id[1:] == segment_id[:-1])
+            gain = np.bincount(segment_id[:-1], weights=np.clip(step, 0, None), minlength=n_segments)
+            loss = np.bincount(segment_id[:-1], weights=np.clip(-step, 0, None), minlength=n_segments)
+        return gain, loss
+    ref = None
+    current = -1
+    for value, seg in zip(ele.tolist(), segment_id.tolist()):
+        if seg != current:
+            current, ref = seg, value
+            continue
+        change = value - ref
+        if change >= threshold and change > 0:
+            gain[seg] += change
+            ref = value
+        elif change <= -threshold and change < 0:
+            loss[seg] -= change
+            ref = value
+    return gain, loss
+
+def track_statistics(track, elevation_threshold=0.0, moving_speed=1.0):
+    """
+    Distance (km), elevation gain/loss (m), elapsed and moving time (hours) of a track, in total and per segment
+    (per file in chain mode). Steps that cross a segment boundary are not counted. A step counts as moving when
+    its speed is at least moving_speed km/h.
+    """
+    n = len(track)
+    n_segments = track.segment_count
+    segment_id = np.zeros(n, dtype=np.int64)
+    if n_segments > 1:
+        segment_id[track.offsets[1:]] = 1
+        segment_id = np.cumsum(segment_id)
+
+    distance = np.zeros(n_segments)
+    elapsed = np.zeros(n_segments)
+    moving = np.zeros(n_segments)
+    if n > 1:
+        same_segment = segment_id[1:] == segment_id[:-1]
+        step_km = haversine_array(track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:]) * same_segment
+        valid = track.has_time()
+        timed = valid[1:] & valid[:-1] & same_segment
+        step_s = np.where(timed, track.time[1:] - track.time[:-1], 0).astype(np.float64)
+        step_s[step_s < 0] = 0
+        speed = np.divide(step_km * 3600, step_s, out=np.zeros_like(step_s), where=step_s > 0)
+        step_segment = segment_id[:-1]
+        distance = np.bincount(step_segment, weights=step_km, minlength=n_segments)
+        moving = np.bincount(step_segment, weights=np.where(speed >= moving_speed, step_s, 0), minlength=n_segments) / 3600
+        #elapsed time is the span between the first and last timestamp of each segment
+        last = np.maximum.reduceat(np.where(valid, track.time, np.iinfo(np.int64).min + 1), track.offsets)
+        first = np.minimum.reduceat(np.where(valid, track.time, np.iinfo(np.int64).max), track.offsets)
+        has_time = np.add.reduceat(valid, track.offsets) > 1
+        elapsed = np.where(has_time, last - np.where(has_time, first, last), 0) / 3600
+        moving = np.minimum(moving, elapsed)
+    gain, loss = _hysteresis_climb(track.ele.astype(np.float64), segment_id, elevation_threshold)
+
+    return {
+        "distance": float(distance.sum()),
+        "gain": float(gain.sum()),
+        "loss": float(loss.sum()),
+        "elapsed": float(elapsed.sum()),
+        "moving": float(moving.sum()),
+        "segments": {"distance": distance, "gain": gain, "loss": loss, "elapsed": elapsed, "moving": moving},
+    }
+
+def format_hours(hours):
+    hrs = int(hours)
+    return f"{hrs}h {int((hours - hrs) * 60)}m"
 
 def update_text_object(obj_name, new_text):
     """Updates the text of a Blender text object."""
@@ -3363,6 +5032,25 @@ def find_path_endpoints(curve_obj):
     
     return start_point, end_point
 
+def flatten_height_spikes(heights, edges, limit):
+    """
+    Set every vertex that is more than limit away from the average height of its edge neighbours to that
+    average. Vertices are visited in order and see the already corrected heights of earlier ones.
+    heights is a list that is changed in place; returns the number of corrected vertices.
+    """
+    neighbours = [[] for _ in heights]
+    for a, b in edges:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    fixed_count = 0
+    for v, linked in enumerate(neighbours):
+        if linked:
+            avg_z = sum(heights[o] for o in linked) / len(linked)
+            if abs(heights[v] - avg_z) > limit:
+                heights[v] = avg_z
+                fixed_count += 1
+    return fixed_count
+
 def fix_mesh_anomalies(obj, threshold=0.1):
     """
     修复网格中的异常点
@@ -3389,21 +5077,12 @@ def fix_mesh_anomalies(obj, threshold=0.1):
     bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=threshold * 0.01)
     
     # 3. 检测并修复异常高的顶点（相对于邻近顶点）
-    fixed_count = 0
-    for v in bm.verts:
-        if len(v.link_edges) > 0:
-            # 计算相邻顶点的平均Z值
-            neighbor_z = []
-            for edge in v.link_edges:
-                other_vert = edge.other_vert(v)
-                neighbor_z.append(other_vert.co.z)
-            
-            if neighbor_z:
-                avg_z = sum(neighbor_z) / len(neighbor_z)
-                # 如果当前顶点的Z值与邻近顶点的平均值相差太大，则修正它
-                if abs(v.co.z - avg_z) > threshold * 10:
-                    v.co.z = avg_z
-                    fixed_count += 1
+    bm.verts.index_update()
+    heights = [v.co.z for v in bm.verts]
+    edges = [(e.verts[0].index, e.verts[1].index) for e in bm.edges]
+    fixed_count = flatten_height_spikes(heights, edges, threshold * 10)
+    for v, z in zip(bm.verts, heights):
+        v.co.z = z
     
     if fixed_count > 0:
         print(f"修复了 {fixed_count} 个异常点")
@@ -4338,26 +6017,53 @@ def intersect_trails_with_existing_box(cutobject):
         writeMetadata(cube,"TRAIL")
 
 
-def separate_duplicate_xy(coordinates, offset=0.05):
-    seen_xy = set()
-
-    for i, point in enumerate(coordinates):
-        # Convert tuple to list if needed
-        if isinstance(point, tuple):
-            point = list(point)
-            coordinates[i] = point  # Update the original array with the list version
-
-        x, y, z = point[0], point[1], point[2]
-        xy_key = (x, y,z)
-
-        if xy_key in seen_xy:
-            point[2] += offset
-            point[1] += offset
-            #print("Duplicate")
-        else:
-            seen_xy.add(xy_key)
-    
-    return(coordinates)
+def separate_duplicate_xy(coordinates, offset=0.05, cell=0.05):
+    """
+    Lifts points that land on (or within cell of) an earlier part of the path, so the bevelled curve does
+    not produce degenerate geometry where a route doubles back. XY is hashed into a grid of size cell and
+    every point is compared with all earlier points in the 3x3 cells around it. Near points that only follow
+    each other along the path (less than 3 cells of arc length apart) are left alone; exact repeats of an
+    earlier point are always lifted. Takes and returns an (N, 3) array.
+    """
+    coordinates = np.array(coordinates, dtype=np.float64)
+    n = len(coordinates)
+    if n < 2:
+        return coordinates
+    xy = coordinates[:, :2]
+    step = np.linalg.norm(np.diff(xy, axis=0), axis=1)
+    arc = np.r_[0, np.cumsum(step)]
+
+    #exact repeats of any earlier point (e.g. a paused recording or a route run twice)
+    _, first, inverse = np.unique(coordinates, axis=0, return_index=True, return_inverse=True)
+    duplicate = first[inverse.ravel()] != np.arange(n)
+
+    #points sorted by cell (and by index within a cell), so the points of any cell are one contiguous run
+    cells = np.floor(xy / cell).astype(np.int64)
+    keys = cells[:, 0] * 2**32 + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour = (cells[:, 0] + dx) * 2**32 + cells[:, 1] + dy
+            lo = np.searchsorted(sorted_keys, neighbour, side="left")
+            hi = np.searchsorted(sorted_keys, neighbour, side="right")
+            #walk every stored point of the cell, earliest first, for all points at once. A point stops at the
+            #first hit or at the first candidate that is too close along the path (all later ones are too)
+            active = np.flatnonzero(~duplicate & (hi > lo))
+            ptr = lo[active]
+            end = hi[active]
+            while len(active):
+                j = order[ptr]
+                earlier = arc[active] - arc[j] > 3 * cell
+                hit = earlier & (np.linalg.norm(xy[active] - xy[j], axis=1) < cell)
+                duplicate[active[hit]] = True
+                ptr += 1
+                keep = earlier & ~hit & (ptr < end)
+                active, ptr, end = active[keep], ptr[keep], end[keep]
+    coordinates[duplicate, 1] += offset
+    coordinates[duplicate, 2] += offset
+    return coordinates
 
 def single_color_mode(crv, mapName):
     """
@@ -4745,6 +6451,7 @@ def coloring_main(map,kind = "WATER"):
     lons = math.ceil((maxLon - minLon) / lon_step)
 
     created_objects = []
+    projection = ProjectionContext.from_scene()
 
     #print(f"lats: {lats}, lons: {lons}")
     if lats * lons < 20:
@@ -4776,8 +6483,12 @@ def coloring_main(map,kind = "WATER"):
                 bodies = extract_multipolygon_bodies(data['elements'], nodes)
                 #print(f"Nodes: {len(nodes)}, Bodies: {len(bodies)}")
 
+                #project every node once instead of once per way that references it
+                node_ids = list(nodes.keys())
+                node_xyz = dict(zip(node_ids, project_points([(nodes[n]['lat'], nodes[n]['lon'], 0) for n in node_ids], projection)))
+
                 for i, coords in enumerate(bodies):
-                    blender_coords = [convert_to_blender_coordinates(lat, lon, ele, 0) for lat, lon, ele in coords]
+                    blender_coords = project_points(coords, projection)
                     calcArea = calculate_polygon_area_2d(blender_coords)
                     #print(f"tArea1: {calcArea}")
                     if calcArea > col_Area:
@@ -4793,14 +6504,7 @@ def coloring_main(map,kind = "WATER"):
                         waterDeleted += 1
                         continue
 
-                    coords = []
-                    for node_id in element.get('nodes', []):
-                        if node_id in nodes:
-                            node = nodes[node_id]
-                            coord = convert_to_blender_coordinates(
-                                node['lat'], node['lon'], 0,0
-                            )
-                            coords.append(coord)
+                    coords = [node_xyz[node_id] for node_id in element.get('nodes', []) if node_id in node_xyz]
                     tArea = calculate_polygon_area_2d(coords)
                     #print(f"tArea2: {tArea}")
                     if len(coords) < 2 or tArea < col_Area:
@@ -5360,9 +7064,13 @@ def writeMetadata(obj, type = "MAP"):
         obj["Generation Duration"] = str(duration) + " seconds"  # 生成耗时
         obj["Shape"] = bpy.context.scene.tp3d.shape
         obj["Resolution"] = bpy.context.scene.tp3d.num_subdivisions
+        obj["simplifyTerrain"] = bpy.context.scene.tp3d.simplifyTerrain
+        obj["terrainMaxError"] = round(bpy.context.scene.tp3d.terrainMaxError,3)
         obj["Elevation Scale"] = bpy.context.scene.tp3d.scaleElevation
         obj["objSize"] = bpy.context.scene.tp3d.objSize
         obj["pathThickness"] = round(bpy.context.scene.tp3d.pathThickness,2)
+        obj["simplifyMethod"] = bpy.context.scene.tp3d.simplifyMethod
+        obj["nozzleWidth"] = round(bpy.context.scene.tp3d.nozzleWidth,2)
         obj["overwritePathElevation"] = bpy.context.scene.tp3d.overwritePathElevation
         obj["api"] = bpy.context.scene.tp3d.api
         obj["scalemode"] = bpy.context.scene.tp3d.scalemode
@@ -5542,10 +7250,22 @@ def runGeneration(type):
     size =  bpy.context.scene.tp3d.get('objSize', 100)
     global num_subdivisions
     num_subdivisions = bpy.context.scene.tp3d.get('num_subdivisions', 8)
+    global simplifyTerrain
+    simplifyTerrain = bpy.context.scene.tp3d.get('simplifyTerrain', False)
+    global terrainMaxError
+    terrainMaxError = bpy.context.scene.tp3d.get('terrainMaxError', 0.1)
     global scaleElevation
     scaleElevation = bpy.context.scene.tp3d.get('scaleElevation', 2)
     global pathThickness
     pathThickness = bpy.context.scene.tp3d.get('pathThickness', 1.2)
+    global simplifyMethod
+    simplifyMethod = bpy.context.scene.tp3d.simplifyMethod
+    global nozzleWidth
+    nozzleWidth = bpy.context.scene.tp3d.get('nozzleWidth', 0.4)
+    global elevationThreshold
+    elevationThreshold = bpy.context.scene.tp3d.get('elevationThreshold', 0.0)
+    global movingSpeed
+    movingSpeed = bpy.context.scene.tp3d.get('movingSpeed', 1.0)
     global scalemode
     scalemode = bpy.context.scene.tp3d.scalemode
     global pathScale
@@ -5740,10 +7460,8 @@ def runGeneration(type):
     # Disable Auto Merge Vertices
     bpy.context.scene.tool_settings.use_mesh_automerge = False
         
-    coordinates = []
-    coordinates2 = []
-    tempcoordinates = []
-    separate_paths = []
+    coordinates2 = None
+    separate_paths = Track([], [])
     # Load GPX data        
     #try:
     if 1 == 1:
@@ -5753,28 +7471,25 @@ def runGeneration(type):
         if type == 1:
             separate_paths = read_gpx_directory(gpx_chain_path)
         if type == 2 or type == 4:
-            nlat,nlon = move_coordinates(jMapLat,jMapLon,jMapRadius,"e")
-            separate_paths.append([(nlat,nlon,0,0)])
-            nlat,nlon = move_coordinates(jMapLat,jMapLon,jMapRadius,"s")
-            separate_paths.append([(nlat,nlon,0,0)])
-            nlat,nlon = move_coordinates(jMapLat,jMapLon,jMapRadius,"w")
-            separate_paths.append([(nlat,nlon,0,0)])
-            nlat,nlon = move_coordinates(jMapLat,jMapLon,jMapRadius,"n")
-            separate_paths.append([(nlat,nlon,0,0)])
+            corners = []
+            for direction in ("e", "s", "w", "n"):
+                nlat,nlon = move_coordinates(jMapLat,jMapLon,jMapRadius,direction)
+                corners.append([(nlat,nlon,0,None)])
+            separate_paths = Track.from_segments(corners)
 
             if type == 4:
-                tempcoordinates = read_gpx_file()
-                coordinates2 = [item for sublist in tempcoordinates for item in sublist]
+                coordinates2 = read_gpx_file()
 
         if type == 3:
-            separate_paths.append([(jMapLat1,jMapLon1,0,0)])
-            separate_paths.append([(jMapLat2,jMapLon2,0,0)])
+            separate_paths = Track.from_segments([[(jMapLat1,jMapLon1,0,None)], [(jMapLat2,jMapLon2,0,None)]])
     #except Exception as e:
     else:
         show_message_box(f"读取GPX文件时出错。类型：{type}")
         return
-    coordinates = [item for sublist in separate_paths for item in sublist]
-    #coordinates = separate_paths
+    if separate_paths is None or (type == 4 and coordinates2 is None):
+        return
+    #all segments as one track (segment offsets are kept)
+    coordinates = separate_paths
 
     #print(f"separaite paits: {len(separate_paths)}")
     
@@ -5788,47 +7503,28 @@ def runGeneration(type):
     total_length = 0
     total_elevation = 0
     total_time = 0
+    bpy.context.scene.tp3d["o_trackStats"] = ""
     if type == 0 or type == 1:
-        total_length = calculate_total_length(coordinates)
-        total_elevation = calculate_total_elevation(coordinates)
-        total_time = calculate_total_time(coordinates)
+        stats = track_statistics(coordinates, elevationThreshold, movingSpeed)
+        total_length = stats["distance"]
+        total_elevation = stats["gain"]
+        total_time = stats["elapsed"]
+        bpy.context.scene.tp3d["o_trackStats"] = f"{total_length:.1f} km  ↑{stats['gain']:.0f} m  ↓{stats['loss']:.0f} m  运动 {format_hours(stats['moving'])}"
+        if type == 1 and chainFiles:
+            #a file can hold several track segments, sum them per file
+            first = [start for _, start in chainFiles]
+            per_file = {key: np.add.reduceat(values, first) for key, values in stats["segments"].items()}
+            for i, (filename, _) in enumerate(chainFiles):
+                print(f"{filename}: {per_file['distance'][i]:.2f} km, +{per_file['gain'][i]:.0f} m / -{per_file['loss'][i]:.0f} m, "
+                      f"elapsed {format_hours(per_file['elapsed'][i])}, moving {format_hours(per_file['moving'][i])}")
 
-
-    hours = int(total_time)
-    minutes = int((total_time - hours) * 60)
     global time_str
-    time_str = f"{hours}h {minutes}m"
-
-    while len(coordinates) < 300 and len(coordinates) > 1 and type != 2:
-        i = 0
-        while i < len(coordinates) - 1:
-            p1 = coordinates[i]
-            p2 = coordinates[i + 1]
-
-            # Calculate midpoint (only for x, y, z)
-            midpoint = (
-                (p1[0] + p2[0]) / 2,
-                (p1[1] + p2[1]) / 2,
-                (p1[2] + p2[2]) / 2,
-                (p1[3])  # Optional: interpolate time too
-            )
-
-            # Insert midpoint before p2
-            coordinates.insert(i + 1, midpoint)
-
-            # Skip over the new point and the original next point
-            i += 2
-    
-
-    #CALCULATE biggest distance so you can calculate the value for the smoothing
-    min_x = max(point[0] for point in coordinates)
-    max_x = max(point[0] for point in coordinates)
-    min_y = min(point[1] for point in coordinates)
-    max_y = max(point[1] for point in coordinates)
-    p1 = convert_to_blender_coordinates(min_x, min_y, 0,"")
-    p2 = convert_to_blender_coordinates(max_x,max_y, 0,"")
+    time_str = format_hours(total_time)
 
-    distance = math.sqrt((p2[0] - p1[0]) ** 2 + (p2[1] - p1[1]) ** 2)
+    #short paths get extra points so the curve follows the terrain; simplification must keep them
+    densified = None
+    if type != 2 and 1 < len(coordinates) < 300:
+        coordinates, densified = resample_track(coordinates, count=300, keep_vertices=True, return_inserted=True)
 
 
     #Überschreiben der elevation werte der GXP mit den Elevation werte der gleichen API mit der das Terrain erstellt wird
@@ -5890,21 +7586,12 @@ def runGeneration(type):
 
     # Convert coordinates to Blender format and create a curve
     #print("Converting Coordinates to Blender format coordinates for X and Y coordsd")
-    blender_coords = [convert_to_blender_coordinates(lat, lon, ele,timestamp) for lat, lon, ele, timestamp in coordinates]
-    
-    if type == 1 or len(separate_paths) > 1:
-        blender_coords_separate = [
-            [convert_to_blender_coordinates(lat, lon, ele, timestamp) for lat, lon, ele, timestamp in path]
-            for path in separate_paths
-            ]
-
-  
+    projection = ProjectionContext.from_scene()
+    blender_coords = coordinates.project(projection)
     
     #CALCULATE CENTER
-    min_x = min(point[0] for point in blender_coords)
-    max_x = max(point[0] for point in blender_coords)
-    min_y = min(point[1] for point in blender_coords)
-    max_y = max(point[1] for point in blender_coords)
+    min_x, min_y = blender_coords[:, :2].min(axis=0)
+    max_x, max_y = blender_coords[:, :2].max(axis=0)
     
     global centerx
     global centery
@@ -5970,6 +7657,7 @@ def runGeneration(type):
 
     if type == 4:
         coordinates = coordinates2
+        densified = None
     
 
     #fetch and apply the elevation
@@ -6011,25 +7699,23 @@ def runGeneration(type):
 
     
     #RECALCULATE THE COORDS WITH AUTOSCALE APPLIED
-    blender_coords = [convert_to_blender_coordinates(lat, lon, ele,timestamp) for lat, lon, ele, timestamp in coordinates]
+    projection = ProjectionContext.from_scene()
+    blender_coords = coordinates.project(projection)
 
-    blender_coords = simplify_curve(blender_coords, .12)
+    blender_coords = simplify_path(blender_coords, fixed=densified)
 
     #PREVENT CLIPPING OF IDENTICAL COORDINATES
-    blender_coords = separate_duplicate_xy(blender_coords, 0.05) 
+    blender_coords = separate_duplicate_xy(blender_coords, 0.05, path_tolerance() / 2)
     
-    if (type == 1 or len(separate_paths) > 1) and type != 4:
-        blender_coords_separate = [
-            [convert_to_blender_coordinates(lat, lon, ele, timestamp) for lat, lon, ele, timestamp in path]
-            for path in separate_paths
-            ]
+    if (type == 1 or separate_paths.segment_count > 1) and type != 4:
+        blender_coords_separate = [simplify_path(crds) for crds in separate_paths.split(separate_paths.project(projection))]
     
     #calculate real Scale
     tdist = 0
-    lat1 = coordinates[0][0]
-    lon1 = coordinates[0][1]
-    lat2 = coordinates[-1][0]
-    lon2 = coordinates[-1][1]
+    lat1 = coordinates.lat[0]
+    lon1 = coordinates.lon[0]
+    lat2 = coordinates.lat[-1]
+    lon2 = coordinates.lon[-1]
     tdist = haversine(lat1,lon1 ,lat2 , lon2)
     #print(f"lat1: {lat1} | lon1: {lon1} ||| lat2: {lat2} | lon2: {lon2}")
     #print(f"tdist:{tdist}")
@@ -6043,7 +7729,7 @@ def runGeneration(type):
     global curveObj
     curveObj = None
     try:
-        if type == 0 or len(blender_coords_separate) == 1 or type == 4:
+        if type == 0 or type == 4 or len(blender_coords_separate) == 1:
             #print(blender_coords)
             create_curve_from_coordinates(blender_coords)
             curveObj = bpy.context.view_layer.objects.active
@@ -6066,33 +7752,23 @@ def runGeneration(type):
 
     global lowestZ
     global highestZ  
-    lowestZ = 1000
-    highestZ = 0
+    heights = np.asarray(tileVerts, dtype=np.float64)
+    vertex_count = len(mesh.vertices)
     
     # 添加边界检查：确保 tileVerts 和 mesh.vertices 数量匹配
-    if len(tileVerts) != len(mesh.vertices):
-        print(f"警告: tileVerts 长度 ({len(tileVerts)}) 与顶点数量 ({len(mesh.vertices)}) 不匹配!")
-        show_message_box(f"海拔数据不匹配！预期{len(mesh.vertices)}个点但获得{len(tileVerts)}个。请尝试降低分辨率或重新生成。", "ERROR", "错误")
-        # 使用安全的索引访问
-        for i, vert in enumerate(mesh.vertices):
-            if i < len(tileVerts):
-                vert.co.z = (tileVerts[i] - elevationOffset)/1000 * scaleElevation * autoScale
-            else:
-                # 超出范围的顶点使用最后一个已知海拔值
-                vert.co.z = (tileVerts[-1] - elevationOffset)/1000 * scaleElevation * autoScale
-            if vert.co.z < lowestZ:
-                lowestZ = vert.co.z
-            if vert.co.z > highestZ:
-                highestZ = vert.co.z
-    else:
-        # 正常情况：长度匹配
-        for i, vert in enumerate(mesh.vertices):
-            vert.co.z = (tileVerts[i] - elevationOffset)/1000 * scaleElevation * autoScale
-            if vert.co.z < lowestZ:
-                lowestZ = vert.co.z
-            if vert.co.z > highestZ:
-                highestZ = vert.co.z
-            
+    if len(heights) != vertex_count:
+        print(f"警告: tileVerts 长度 ({len(heights)}) 与顶点数量 ({vertex_count}) 不匹配!")
+        show_message_box(f"海拔数据不匹配！预期{vertex_count}个点但获得{len(heights)}个。请尝试降低分辨率或重新生成。", "ERROR", "错误")
+        # 超出范围的顶点使用最后一个已知海拔值
+        if len(heights) > vertex_count:
+            heights = heights[:vertex_count]
+        else:
+            heights = np.concatenate((heights, np.full(vertex_count - len(heights), heights[-1] if len(heights) else 0.0)))
+
+    zs = set_vertex_heights(mesh, (heights - elevationOffset)/1000 * scaleElevation * autoScale)
+    lowestZ = min(1000, float(zs.min())) if vertex_count else 1000
+    highestZ = max(0, float(zs.max())) if vertex_count else 0
+
     global additionalExtrusion
     additionalExtrusion = lowestZ
 
@@ -6101,6 +7777,11 @@ def runGeneration(type):
     # 修复网格中的异常点
     print("正在修复网格异常点...")
     fix_mesh_anomalies(MapObject, threshold=0.1)
+
+    #simplify the cleaned dense grid; the RTIN keeps exactly the vertices that stand out, so the spike filter must not run on it
+    if simplifyTerrain:
+        simplify_terrain_mesh(MapObject, terrainMaxError)
+        bpy.context.scene.tp3d["o_verticesMap"] = str(len(mesh.vertices))
     
     #Raycast the curve points onto the Mesh surface
     if overwritePathElevation == True:
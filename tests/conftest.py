@@ -0,0 +1,39 @@
+"""
+Loads TrailPrint3D.py outside of Blender for the tests of its pure NumPy helpers.
+bpy, bmesh and mathutils are replaced by mocks; config files go to a temporary folder.
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+import types
+from unittest.mock import MagicMock
+
+import pytest
+
+ADDON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "TrailPrint3D.py")
+
+
+def _load_addon():
+    config_dir = tempfile.mkdtemp(prefix="tp3d_test_")
+    bpy = MagicMock()
+
+    class _Base:
+        pass
+
+    bpy.types = types.SimpleNamespace(PropertyGroup=_Base, Operator=_Base, Panel=_Base, Scene=_Base)
+    bpy.utils.user_resource = lambda kind: config_dir
+    bpy.app.version = (4, 5, 0)
+    sys.modules["bpy"] = bpy
+    sys.modules["bmesh"] = MagicMock()
+    sys.modules["mathutils"] = MagicMock()
+
+    spec = importlib.util.spec_from_file_location("TrailPrint3D", ADDON_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def tp3d():
+    return _load_addon()
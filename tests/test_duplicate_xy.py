@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def lifted(tp3d, points, cell=0.05):
+    points = np.array(points, dtype=np.float64)
+    return (tp3d.separate_duplicate_xy(points, 0.05, cell) != points).any(axis=1)
+
+
+def test_exact_repeats_are_lifted_even_when_close_along_the_path(tp3d):
+    points = [(0, 0, 0), (0.01, 0, 0), (0, 0, 0), (0.02, 0, 0), (0.02, 0, 0)]
+    assert lifted(tp3d, points).tolist() == [False, False, True, False, True]
+
+
+def test_points_near_any_earlier_point_of_a_cell_are_lifted(tp3d):
+    # the way back passes 0.03 next to the way out; the earliest point of each cell is not always the nearest
+    out = [(x, 0.0, 0.0) for x in np.arange(0, 1, 0.02)]
+    back = [(x, 0.03, 1.0) for x in np.arange(0.99, 0, -0.02)]
+    result = lifted(tp3d, out + back)
+    assert not result[:len(out)].any()
+    assert result[len(out) + 5:].all()
+
+
+def test_every_stored_point_of_a_cell_is_compared(tp3d):
+    # the last point is far from the earliest point of its cell but next to the second one
+    points = [(0.001, 0.001, 0), (1, 0, 0), (1, 1, 0), (0.049, 0.049, 0), (1, 2, 0), (2, 2, 0), (0.045, 0.045, 0)]
+    assert lifted(tp3d, points).tolist() == [False] * 6 + [True]
+
+
+def test_consecutive_close_points_are_left_alone(tp3d):
+    points = [(x, 0.0, 0.0) for x in np.arange(0, 1, 0.01)]
+    assert not lifted(tp3d, points).any()
@@ -0,0 +1,35 @@
+import pytest
+import requests
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def json(self):
+        return {"results": [{"elevation": 12.5}]}
+
+
+def test_rate_limited_requests_are_retried(tp3d, monkeypatch):
+    responses = [Response(429, {"Retry-After": "3"}), Response(429), Response(200)]
+    waits = []
+    monkeypatch.setattr(tp3d.time, "sleep", waits.append)
+    monkeypatch.setattr(tp3d.requests, "get", lambda url: responses.pop(0))
+
+    assert tp3d.fetch_openTopoData_batch([(47.0, 8.0)]) == {"results": [{"elevation": 12.5}]}
+    assert waits == [3.0, 2]
+
+
+def test_rate_limit_gives_up_after_the_retries(tp3d, monkeypatch):
+    waits = []
+    monkeypatch.setattr(tp3d.time, "sleep", waits.append)
+    monkeypatch.setattr(tp3d.requests, "get", lambda url: Response(429))
+
+    with pytest.raises(requests.HTTPError):
+        tp3d.fetch_openTopoData_batch([(47.0, 8.0)])
+    assert waits == [1, 2, 4, 8]
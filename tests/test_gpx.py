@@ -0,0 +1,30 @@
+def write_gpx(tmp_path, body):
+    path = tmp_path / "track.gpx"
+    path.write_text(
+        '<?xml version="1.0"?>\n'
+        '<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">' + body + '</gpx>'
+    )
+    return str(path)
+
+
+def test_routes_are_ignored_when_the_file_has_track_segments(tp3d, tmp_path):
+    path = write_gpx(tmp_path,
+        '<rte><rtept lat="1" lon="1"/><rtept lat="2" lon="2"/></rte>'
+        '<trk><trkseg><trkpt lat="47" lon="8"><ele>500</ele></trkpt>'
+        '<trkpt lat="47.1" lon="8.1"><ele>510</ele></trkpt></trkseg></trk>')
+    track, version, point_type, sections = tp3d.read_gpx_stream(path)
+    assert version == "1.1"
+    assert point_type == "trkpt"
+    assert sections == 1
+    assert list(track.offsets) == [0]
+    assert list(track.lat) == [47, 47.1]
+
+
+def test_routes_are_read_when_the_file_has_no_track_segments(tp3d, tmp_path):
+    path = write_gpx(tmp_path,
+        '<rte><rtept lat="1" lon="1"/><rtept lat="2" lon="2"/></rte>'
+        '<rte><rtept lat="3" lon="3"/></rte>')
+    track, _, point_type, _ = tp3d.read_gpx_stream(path)
+    assert point_type == "rtept"
+    assert list(track.offsets) == [0, 2]
+    assert list(track.lat) == [1, 2, 3]
@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def test_local_dem_index_opens_tiles_only_when_sampled(tp3d, tmp_path, monkeypatch):
+    heights = np.array([[400, 500, 600], [300, 400, 500], [200, 300, 400]], dtype=">i2")
+    heights.tofile(tmp_path / "N47E008.hgt")
+    heights.tofile(tmp_path / "N10E020.hgt")
+
+    opened = []
+    open_hgt_tile = tp3d.open_hgt_tile
+    monkeypatch.setattr(tp3d, "open_hgt_tile", lambda path, lat, lon: opened.append(path) or open_hgt_tile(path, lat, lon))
+    monkeypatch.setattr(tp3d, "_local_dem_index", None)
+    monkeypatch.setattr(tp3d.bpy.path, "abspath", lambda path: path)
+    monkeypatch.setattr(tp3d.bpy.context.scene.tp3d, "get", lambda key, default=None: str(tmp_path))
+
+    hgt_tiles, geotiffs = tp3d.load_local_dem_index(str(tmp_path))
+    assert hgt_tiles == {(47, 8): str(tmp_path / "N47E008.hgt"), (10, 20): str(tmp_path / "N10E020.hgt")}
+    assert geotiffs == []
+    assert opened == []
+
+    # (48, 8) lies on row 0 (the north edge) of N47E008 and (48, 9) on its north-east corner
+    elevations = tp3d.get_elevation_LocalDEM([(47.5, 8.5), (48.0, 8.0), (48.0, 9.0), (0.5, 0.5)])
+    assert elevations == [400.0, 400.0, 600.0, 0.0]
+    assert opened == [str(tmp_path / "N47E008.hgt")]
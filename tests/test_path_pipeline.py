@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def short_track(tp3d):
+    return tp3d.Track.from_segments([[
+        (47.000, 8.000, 500, None),
+        (47.010, 8.000, 520, None),
+        (47.010, 8.015, 540, None),
+        (47.020, 8.020, 530, None),
+        (47.025, 8.030, 560, None),
+    ]])
+
+
+def test_resample_then_simplify_keeps_densified_samples(tp3d):
+    track, inserted = tp3d.resample_track(short_track(tp3d), count=300, keep_vertices=True, return_inserted=True)
+    assert len(track) >= 300
+    assert inserted.sum() == len(track) - 5
+
+    points = track.project(tp3d.ProjectionContext(10))
+    for method in ("DOUGLAS_PEUCKER", "VISVALINGAM", "DISTANCE"):
+        simplified = tp3d.simplify_path(points, tolerance=0.2, method=method, fixed=inserted)
+        assert len(simplified) >= inserted.sum()
+        # every inserted sample survives, in order
+        kept = np.isin(points.view([("", points.dtype)] * 3), simplified.view([("", simplified.dtype)] * 3)).ravel()
+        assert kept[inserted].all()
+
+
+def test_simplify_without_fixed_points_drops_collinear_samples(tp3d):
+    track = tp3d.resample_track(short_track(tp3d), count=300, keep_vertices=True)
+    points = track.project(tp3d.ProjectionContext(10))
+    simplified = tp3d.simplify_path(points, tolerance=0.2, method="DOUGLAS_PEUCKER")
+    assert len(simplified) < 20
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+
+def interpolation_error(heights, tris):
+    """Largest distance between any grid point and the triangle covering it, checked independently of the add-on."""
+    worst = np.zeros(heights.shape)
+    covered = np.zeros(heights.shape, dtype=bool)
+    for a, b, c in tris.astype(float):
+        lo = np.floor(np.min((a, b, c), axis=0)).astype(int)
+        hi = np.ceil(np.max((a, b, c), axis=0)).astype(int)
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                p = np.array((x, y), dtype=float)
+                m = np.column_stack((a - c, b - c))
+                s, t = np.linalg.solve(m, p - c)
+                if s < -1e-9 or t < -1e-9 or s + t > 1 + 1e-9:
+                    continue
+                ha, hb, hc = (heights[tuple(q.astype(int))] for q in (a, b, c))
+                plane = hc + s * (ha - hc) + t * (hb - hc)
+                worst[x, y] = max(worst[x, y], abs(heights[x, y] - plane))
+                covered[x, y] = True
+    return worst, covered
+
+
+@pytest.mark.parametrize("shape", ["hexagon", "circle", "square"])
+@pytest.mark.parametrize("max_error", [0.05, 0.3, 1.0])
+def test_rtin_stays_within_max_error(tp3d, shape, max_error):
+    rng = np.random.default_rng(7)
+    if shape == "hexagon":
+        _, _, (index, roots, forced) = tp3d.hexagon_grid(50, 4)
+    elif shape == "circle":
+        _, _, (index, roots, forced) = tp3d.circle_grid(50, 64, 2)
+    else:
+        _, _, (index, roots, forced) = tp3d.rectangle_grid(50, 50, 4)
+    x, y = np.meshgrid(np.arange(index.shape[0]), np.arange(index.shape[1]), indexing="ij")
+    heights = 3 * np.sin(x / 3.0) * np.cos(y / 4.0) + rng.normal(0, 0.2, index.shape)
+    heights[index < 0] = 0.0
+
+    errors = tp3d.rtin_vertex_errors(heights, roots, forced)
+    tris = tp3d.rtin_triangles(errors, roots, max_error)
+    worst, covered = interpolation_error(heights, tris)
+
+    assert covered[index >= 0].all()
+    assert worst.max() <= max_error + 1e-9
+    assert len(tris) < 2 * (index >= 0).sum()
+
+
+def face_edges(faces):
+    edges = set()
+    for face in faces.tolist():
+        for a, b in zip(face, face[1:] + face[:1]):
+            edges.add((min(a, b), max(a, b)))
+    return sorted(edges)
+
+
+def fractal_heights(m, relief, seed=3):
+    rng = np.random.default_rng(seed)
+    heights = np.zeros((m + 1, m + 1))
+    for octave in range(1, 7):
+        k = 2 ** octave
+        coarse = rng.normal(0, 1, (k + 1, k + 1))
+        x = np.linspace(0, k, m + 1)
+        i = np.minimum(x.astype(int), k - 1)
+        f = x - i
+        rows = coarse[i] * (1 - f)[:, None] + coarse[i + 1] * f[:, None]
+        heights += (rows[:, i] * (1 - f) + rows[:, i + 1] * f) / k
+    return (heights - heights.min()) / np.ptp(heights) * relief
+
+
+def test_spike_filter_runs_before_rtin(tp3d):
+    _, faces, (index, roots, forced) = tp3d.rectangle_grid(100, 100, 6)
+    heights = fractal_heights(index.shape[0] - 1, 25.0)
+    limit = 1.0  # fix_mesh_anomalies(threshold=0.1)
+
+    # the dense grid is filtered first ...
+    flat = heights.ravel().tolist()
+    tp3d.flatten_height_spikes(flat, face_edges(faces), limit)
+    filtered = np.array(flat).reshape(heights.shape)
+
+    # ... then simplified, which keeps the bound against the filtered surface
+    max_error = 0.5
+    tris = tp3d.rtin_triangles(tp3d.rtin_vertex_errors(filtered, roots, forced), roots, max_error)
+    worst, _ = interpolation_error(filtered, tris)
+    assert worst.max() <= max_error + 1e-9
+
+    # running the filter on the simplified mesh instead would move kept vertices by more than the bound
+    simplified = filtered.ravel().tolist()
+    before = list(simplified)
+    tp3d.flatten_height_spikes(simplified, face_edges(index[tris[:, :, 0], tris[:, :, 1]]), limit)
+    moved = np.abs(np.array(simplified) - before)
+    assert moved.max() > max_error
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def linear_tiles():
+    """Tiles whose elevation is the global pixel-centre column plus twice the row."""
+    def load_tile(xtile, ytile):
+        gy, gx = np.mgrid[0:256, 0:256] + 0.5
+        return (gx + xtile * 256 + 2 * (gy + ytile * 256)).astype(np.float32)
+    return load_tile
+
+
+def global_pixel_to_lonlat(gx, gy, zoom):
+    n = 2 ** zoom * 256
+    return gx / n * 360 - 180, np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * gy / n))))
+
+
+def test_mosaic_sampling_is_seamless(tp3d):
+    zoom = 4
+    tiles = [(x, y) for y in (5, 6) for x in (7, 8)]
+    mosaic = tp3d.TerrariumMosaic.assemble(zoom, tiles, linear_tiles())
+    assert mosaic.complete
+
+    # points straddling the seams between the four tiles
+    gx = np.array([8 * 256 - 0.2, 8 * 256 + 0.3, 7 * 256 + 100.7, 8 * 256 + 12.25])
+    gy = np.array([6 * 256 + 0.4, 6 * 256 - 0.1, 6 * 256 + 0.5, 5 * 256 + 255.9])
+    lon, lat = global_pixel_to_lonlat(gx, gy, zoom)
+
+    bilinear = mosaic.sample(lat, lon, True)
+    np.testing.assert_allclose(bilinear, gx + 2 * gy, atol=1e-2)
+    nearest = mosaic.sample(lat, lon, False)
+    np.testing.assert_allclose(nearest, np.floor(gx) + 0.5 + 2 * (np.floor(gy) + 0.5), atol=1e-2)
+
+
+def test_mosaic_reads_tiles_across_the_antimeridian(tp3d):
+    zoom = 2
+    tiles = [(-1, 1), (0, 1)]
+    mosaic = tp3d.TerrariumMosaic.assemble(zoom, tiles, lambda x, y: np.full((256, 256), 100.0 * x, dtype=np.float32))
+    lat = np.array([20.0, 20.0])
+    lon = np.array([179.0, -179.0])
+    np.testing.assert_allclose(mosaic.sample(lat, lon, False), [300.0, 0.0])
+
+
+def test_kept_mosaic_shares_the_tile_memory_budget(tp3d, monkeypatch):
+    mosaic = tp3d.TerrariumMosaic(np.zeros((256, 512), dtype=np.float32), 4, 0, 0)
+    monkeypatch.setattr(tp3d, "tile_memory_budget", lambda: 2**20)
+    monkeypatch.setattr(tp3d, "_tile_lru", None)
+    monkeypatch.setattr(tp3d, "_terrarium_mosaic", mosaic)
+    assert tp3d.get_tile_lru().budget == 2**20 - mosaic.data.nbytes
+
+    monkeypatch.setattr(tp3d, "_terrarium_mosaic", None)
+    assert tp3d.get_tile_lru().budget == 2**20
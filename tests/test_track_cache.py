@@ -0,0 +1,30 @@
+import os
+
+
+GPX = (
+    '<?xml version="1.0"?>\n<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>'
+    '<trkpt lat="47" lon="8"><ele>500</ele></trkpt><trkpt lat="47.1" lon="8.1"><ele>510</ele></trkpt>'
+    '</trkseg></trk></gpx>'
+)
+
+
+def test_track_cache_drops_least_recently_used_files(tp3d, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(tp3d, "track_cache_dir", str(cache_dir))
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"track{i}.gpx"
+        path.write_text(GPX)
+        paths.append(str(path))
+        tp3d.read_gpx_cached(str(path))
+    cached = [tp3d.track_cache_path(p) for p in paths]
+    for i, cache_path in enumerate(cached):
+        os.utime(cache_path, (1000 + i, 1000 + i))
+    # reading the oldest entry again makes it the most recently used one
+    assert tp3d.load_cached_track(paths[0]) is not None
+
+    size = os.path.getsize(cached[0])
+    assert tp3d.trim_track_cache(4 * size) == (0, 0)
+    removed, freed = tp3d.trim_track_cache(3 * size, target=2 / 3)
+    assert (removed, freed) == (2, 2 * size)
+    assert [os.path.exists(p) for p in cached] == [True, False, False, True]
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def climb(tp3d, ele, threshold, segment_id=None):
+    ele = np.asarray(ele, dtype=np.float64)
+    if segment_id is None:
+        segment_id = np.zeros(len(ele), dtype=np.int64)
+    return tp3d._hysteresis_climb(ele, np.asarray(segment_id), threshold)
+
+
+def test_hysteresis_counts_from_the_last_counted_sample(tp3d):
+    # a steady climb to 25 m with a 10 m threshold only counts the 10 m steps that were reached
+    gain, loss = climb(tp3d, np.arange(26), 10)
+    assert gain.tolist() == [20]
+    assert loss.tolist() == [0]
+
+
+def test_hysteresis_ignores_noise_below_the_threshold(tp3d):
+    gain, loss = climb(tp3d, [100, 103, 101, 104, 102, 115, 111, 100], 5)
+    assert gain.tolist() == [15]
+    assert loss.tolist() == [15]
+
+
+def test_hysteresis_restarts_at_every_segment(tp3d):
+    gain, loss = climb(tp3d, [0, 10, 500, 480], 5, [0, 0, 1, 1])
+    assert gain.tolist() == [10, 0]
+    assert loss.tolist() == [0, 20]
+
+
+def test_track_statistics_sums_segments(tp3d):
+    track = tp3d.Track.from_segments([
+        [(47.0, 8.0, 500, None), (47.01, 8.0, 520, None)],
+        [(46.0, 7.0, 800, None), (46.0, 7.01, 790, None)],
+    ])
+    stats = tp3d.track_statistics(track, 0.0, 1.0)
+    assert stats["gain"] == 20
+    assert stats["loss"] == 10
+    np.testing.assert_allclose(stats["segments"]["distance"], [1.112, 0.773], atol=1e-3)
+    assert stats["elapsed"] == 0
+
+
+def test_hysteresis_without_threshold_counts_every_step(tp3d):
+    rng = np.random.default_rng(5)
+    ele = rng.normal(0, 10, 500).cumsum()
+    segment_id = np.repeat([0, 1, 2], [100, 250, 150])
+    gain, loss = climb(tp3d, ele, 0.0, segment_id)
+    for seg in range(3):
+        steps = np.diff(ele[segment_id == seg])
+        assert np.isclose(gain[seg], steps[steps > 0].sum())
+        assert np.isclose(loss[seg], -steps[steps < 0].sum())
+
+
+def test_chain_statistics_are_summed_per_file(tp3d, tmp_path, monkeypatch):
+    header = '<?xml version="1.0"?>\n<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk>'
+    (tmp_path / "a.gpx").write_text(
+        header + '<trkseg><trkpt lat="47" lon="8"><ele>500</ele></trkpt><trkpt lat="47.01" lon="8"><ele>520</ele></trkpt></trkseg>'
+        '<trkseg><trkpt lat="47.02" lon="8"><ele>520</ele></trkpt><trkpt lat="47.03" lon="8"><ele>560</ele></trkpt></trkseg></trk></gpx>')
+    (tmp_path / "b.gpx").write_text(
+        header + '<trkseg><trkpt lat="46" lon="7"><ele>800</ele></trkpt><trkpt lat="46" lon="7.01"><ele>790</ele></trkpt></trkseg></trk></gpx>')
+    monkeypatch.setattr(tp3d, "track_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(tp3d, "track_cache_quota", lambda: 2**30)
+
+    track = tp3d.read_gpx_directory(str(tmp_path), workers=1)
+    assert track.segment_count == 3
+    assert sorted(name for name, _ in tp3d.chainFiles) == ["a.gpx", "b.gpx"]
+
+    stats = tp3d.track_statistics(track, 0.0, 1.0)
+    first = [start for _, start in tp3d.chainFiles]
+    gain = np.add.reduceat(stats["segments"]["gain"], first)
+    assert dict(zip([name for name, _ in tp3d.chainFiles], gain.tolist())) == {"a.gpx": 60, "b.gpx": 0}